@@ -0,0 +1,149 @@
+import math
+import sys
+from array import array
+from typing import Protocol
+
+_MASK64 = 0xFFFF_FFFF_FFFF_FFFF
+
+
+# Keys only have to be told apart within one crawl, so Python's own str hash
+# (64 bits, cached on the string) is good enough and costs next to nothing.
+# It is salted per process, so it must never be persisted.
+def hash64(key: str) -> int:
+    return hash(key) & _MASK64 or 1  # 0 marks an empty slot
+
+
+class Deduplicator(Protocol):
+    def add(self, key: str) -> bool:
+        """Remember `key`, returning False if it was (probably) seen before."""
+        ...
+
+    def __len__(self) -> int: ...
+
+    def memory_bytes(self) -> int: ...
+
+
+class SetDeduplicator:
+    """Exact, but keeps every key string alive for the whole crawl."""
+
+    def __init__(self):
+        self.keys: set[str] = set()
+
+    def add(self, key: str) -> bool:
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self.keys) + sum(sys.getsizeof(k) for k in self.keys)
+
+
+class HashDeduplicator:
+    """
+    Open addressing table of 64-bit key hashes, 8 bytes per slot. Exact up to
+    hash collisions, which are negligible at crawl sizes.
+    """
+
+    max_load = 0.6
+
+    def __init__(self, capacity: int = 1 << 16):
+        self._resize(1 << max(4, math.ceil(math.log2(capacity / self.max_load))))
+        self.count = 0
+
+    def add(self, key: str) -> bool:
+        # This runs for every scraped item, hence hash64 inlined.
+        h = hash(key) & _MASK64 or 1
+        slots = self.slots
+        mask = self.mask
+        i = h & mask
+        while slot := slots[i]:
+            if slot == h:
+                return False
+            i = (i + 1) & mask
+
+        slots[i] = h
+        self.count += 1
+        if self.count > self.limit:
+            self._grow()
+        return True
+
+    def _resize(self, size: int):
+        self.slots = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        self.limit = int(self.max_load * size)
+
+    def _grow(self):
+        old = self.slots
+        self._resize(2 * len(old))
+        slots = self.slots
+        mask = self.mask
+        for h in old:
+            if h == 0:
+                continue
+            i = h & mask
+            while slots[i] != 0:
+                i = (i + 1) & mask
+            slots[i] = h
+
+    def __len__(self) -> int:
+        return self.count
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self.slots)
+
+
+class BloomDeduplicator:
+    """
+    Fixed size Bloom filter. Never lets a duplicate through, but drops roughly
+    `error_rate` of the new keys as long as no more than `capacity` keys are
+    added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.filter = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def add(self, key: str) -> bool:
+        h = hash64(key)
+        # Kirsch-Mitzenmacher: derive every index from two halves of one hash.
+        h1, h2 = h & 0xFFFF_FFFF, (h >> 32) | 1
+        bits, flt = self.bits, self.filter
+        new = False
+        for i in range(self.hashes):
+            idx = (h1 + i * h2) % bits
+            byte, bit = idx >> 3, 1 << (idx & 7)
+            if not flt[byte] & bit:
+                flt[byte] |= bit
+                new = True
+
+        if new:
+            self.count += 1
+        return new
+
+    def __len__(self) -> int:
+        return self.count
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self.filter)
+
+
+def from_settings(settings) -> Deduplicator:
+    match settings.get("UNIQUE_BACKEND", "hash"):
+        case "set":
+            return SetDeduplicator()
+        case "hash":
+            return HashDeduplicator()
+        case "bloom":
+            return BloomDeduplicator(
+                settings.getint("UNIQUE_BLOOM_CAPACITY"),
+                settings.getfloat("UNIQUE_BLOOM_ERROR_RATE"),
+            )
+        case _ as backend:
+            raise ValueError("unknown UNIQUE_BACKEND", backend)
@@ -0,0 +1,91 @@
+from collections.abc import Callable, Mapping
+from typing import Any, TypedDict
+
+from bananalytics.kinds import ItemKind
+from bananalytics.units import parse_quantity, split_quantity
+
+# item_id, name, quantity, unit, stock, price, sale_price, base_quantity, base_unit
+Listing = tuple[str, str, float, str, int, float, float, float | None, str | None]
+
+
+# The parts of the listing payloads that are actually stored. Validating a
+# payload against these instead of `Any` lets pydantic skip building Python
+# objects for every other field.
+class ChaldalAvailability(TypedDict):
+    Quantity: int
+
+
+class ChaldalListingPayload(TypedDict):
+    objectID: int | str
+    nameWithoutSubText: str
+    subText: str
+    mrp: float
+    price: float
+    productAvailabilityForSelectedWarehouse: list[ChaldalAvailability]
+
+
+class MeenabazarListingPayload(TypedDict):
+    ItemId: int | str
+    ItemDisplayName: str
+    Unit: str
+    StockQuantity: int
+    UnitSalesPrice: float
+    DiscountSalesPrice: float
+
+
+def get_quantity_and_unit(text: str) -> tuple[float, str]:
+    """
+    >>> get_quantity_and_unit("KG")
+    (1.0, 'kg')
+    >>> get_quantity_and_unit("1000g")
+    (1000.0, 'g')
+    >>> get_quantity_and_unit("1.1kg")
+    (1.1, 'kg')
+    >>> get_quantity_and_unit("250")
+    (250.0, '')
+    >>> get_quantity_and_unit("250 Gm")
+    (250.0, 'gm')
+    >>> get_quantity_and_unit("500 Gram ±")
+    (500.0, 'gram')
+    >>> get_quantity_and_unit("Each")
+    (1.0, 'each')
+    """
+    return split_quantity(text)
+
+
+def chaldal_listing(d: Mapping[str, Any]) -> Listing:
+    qty, unit, base_qty, base_unit = parse_quantity(d["subText"])
+    availability = d["productAvailabilityForSelectedWarehouse"]
+    return (
+        str(d["objectID"]),
+        d["nameWithoutSubText"],
+        qty,
+        unit,
+        0 if len(availability) == 0 else int(availability[0]["Quantity"]),
+        d["mrp"],
+        d["price"],
+        base_qty,
+        base_unit,
+    )
+
+
+def meenabazar_listing(d: Mapping[str, Any]) -> Listing:
+    qty, unit, base_qty, base_unit = parse_quantity(d["Unit"])
+    return (
+        str(d["ItemId"]),
+        d["ItemDisplayName"],
+        qty,
+        unit,
+        int(d["StockQuantity"]),
+        d["UnitSalesPrice"],
+        d["DiscountSalesPrice"],
+        base_qty,
+        base_unit,
+    )
+
+
+# Only the listing kinds end up as datapoints, everything else is run metadata.
+LISTING_EXTRACTORS: dict[ItemKind, Callable[[Mapping[str, Any]], Listing]] = {
+    ItemKind.Chaldal_LISTING: chaldal_listing,
+    ItemKind.Meenabazar_LISTING: meenabazar_listing,
+}
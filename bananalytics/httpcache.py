@@ -0,0 +1,164 @@
+import logging
+import shutil
+from pathlib import Path
+from time import time
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import (
+    FilesystemCacheStorage,
+    RFC2616Policy,
+    rfc1123_to_epoch,
+)
+from scrapy.utils.httpobj import urlparse_cached
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointTTLPolicy(RFC2616Policy):
+    """
+    Cache responses for as long as HTTPCACHE_ENDPOINT_TTLS says, whatever the
+    vendors' Cache-Control headers claim. Entries are keyed by Scrapy's request
+    fingerprint, which covers the method, URL and body, so each JSON search
+    gets its own entry.
+
+    Endpoints without a TTL, such as the listings, always go to the network.
+    Once an entry is past its TTL it is revalidated with If-None-Match or
+    If-Modified-Since when the cached response carries an ETag or
+    Last-Modified header.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        # Longest prefix first, so a specific endpoint wins over its host.
+        self.ttls = sorted(
+            settings.getdict("HTTPCACHE_ENDPOINT_TTLS").items(),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+
+    def endpoint_ttl(self, request) -> int | None:
+        url = urlparse_cached(request)
+        endpoint = url.netloc + url.path
+        for prefix, ttl in self.ttls:
+            if endpoint.startswith(prefix):
+                return int(ttl)
+        return None
+
+    def should_cache_request(self, request):
+        return self.endpoint_ttl(request) is not None and super().should_cache_request(
+            request
+        )
+
+    def should_cache_response(self, response, request):
+        return response.status == 200 and b"no-store" not in self._parse_cachecontrol(
+            response
+        )
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        """
+        Whether the entry was stored less than the endpoint's TTL ago.
+
+        >>> from tempfile import mkdtemp
+        >>> from scrapy import Spider
+        >>> from scrapy.http import JsonRequest, TextResponse
+        >>> from scrapy.utils.test import get_crawler
+        >>> crawler = get_crawler(Spider, {
+        ...     "HTTPCACHE_DIR": mkdtemp(),
+        ...     "HTTPCACHE_ENDPOINT_TTLS": {"example.com/areas/": 3600},
+        ... })
+        >>> spider = Spider.from_crawler(crawler, "example")
+        >>> storage = BoundedFilesystemCacheStorage(crawler.settings)
+        >>> storage.open_spider(spider)
+        >>> search = lambda: JsonRequest("https://example.com/areas/search", data={"q": "a"})
+        >>> storage.store_response(spider, search(), TextResponse("https://example.com/", body=b"{}"))
+        >>> request = search()
+        >>> cached = storage.retrieve_response(spider, request)
+        >>> EndpointTTLPolicy(crawler.settings).is_cached_response_fresh(cached, request)
+        True
+        """
+        ttl = self.endpoint_ttl(request) or 0
+        stored_at = self.stored_at(cachedresponse, request)
+        if stored_at is not None and time() - stored_at < ttl:
+            return True
+
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+    def stored_at(self, cachedresponse, request) -> float | None:
+        # Set by the storage when it has the entry's timestamp, otherwise the
+        # Date the vendor sent it with is the best guess.
+        stored_at = request.meta.get("cache_timestamp")
+        if stored_at is None:
+            stored_at = rfc1123_to_epoch(cachedresponse.headers.get(b"Date"))
+        return stored_at
+
+
+class RefreshingHttpCacheMiddleware(HttpCacheMiddleware):
+    """
+    HttpCacheMiddleware that stores a cached response again once a 304 has
+    revalidated it, with the headers of the 304 merged in. Its TTL then
+    starts over, rather than every later run revalidating it again.
+    """
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get("cached_response")
+        result = super().process_response(request, response, spider)
+        if response.status != 304 or cachedresponse is None or result is not cachedresponse:
+            return result
+
+        headers = cachedresponse.headers.copy()
+        headers.update(response.headers)
+        refreshed = cachedresponse.replace(headers=headers)
+        self.storage.store_response(spider, request, refreshed)
+        return refreshed
+
+
+class BoundedFilesystemCacheStorage(FilesystemCacheStorage):
+    """
+    FilesystemCacheStorage that evicts the least recently stored entries of a
+    spider once its cache grows beyond HTTPCACHE_MAX_BYTES.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.max_bytes = settings.getint("HTTPCACHE_MAX_BYTES")
+
+    def retrieve_response(self, spider, request):
+        response = super().retrieve_response(spider, request)
+        # Older Scrapy versions don't tell the policy when the entry was
+        # stored, EndpointTTLPolicy needs it to tell the entry's age.
+        if response is not None and "cache_timestamp" not in request.meta:
+            metadata = self._read_meta(spider, request)
+            if metadata is not None:
+                request.meta["cache_timestamp"] = metadata["timestamp"]
+        return response
+
+    def close_spider(self, spider):
+        super().close_spider(spider)
+        if self.max_bytes > 0:
+            self.evict(Path(self.cachedir, spider.name))
+
+    def evict(self, spider_dir: Path):
+        # Entries live in <cachedir>/<spider>/<fp[:2]>/<fp>/
+        entries = []
+        total = 0
+        for entry in spider_dir.glob("*/*"):
+            files = [f.stat() for f in entry.iterdir()]
+            size = sum(f.st_size for f in files)
+            stored_at = max((f.st_mtime for f in files), default=0)
+            entries.append((stored_at, size, entry))
+            total += size
+
+        entries.sort()
+        evicted = 0
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        if evicted:
+            logger.info(
+                "evicted %s entries from the http cache, %s bytes left", evicted, total
+            )
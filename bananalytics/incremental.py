@@ -0,0 +1,56 @@
+import sqlite3
+from hashlib import blake2b
+from time import time
+
+from bananalytics.extractors import LISTING_EXTRACTORS
+from bananalytics.kinds import ItemKind
+
+UNCHANGED_KINDS = {
+    ItemKind.Chaldal_LISTING: ItemKind.Chaldal_LISTING_UNCHANGED,
+    ItemKind.Meenabazar_LISTING: ItemKind.Meenabazar_LISTING_UNCHANGED,
+}
+
+
+def fingerprint(kind: ItemKind, payload: dict) -> bytes:
+    """
+    Hash of exactly the fields etl.py stores for a listing, so changes to
+    anything else in the payload don't count as a change.
+    """
+    values = LISTING_EXTRACTORS[kind](payload)
+    return blake2b(repr(values).encode(), digest_size=8).digest()
+
+
+class FingerprintStore:
+    """
+    Last emitted fingerprint of every listing, kept in SQLite between runs.
+    A run's writes are one transaction, committed by `close` only if the run
+    went through, so a failed run doesn't leave behind fingerprints of
+    listings that never got stored.
+    """
+
+    def __init__(self, filename: str):
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute(
+            """create table if not exists fingerprints (
+                unique_key text primary key,
+                fingerprint blob not null,
+                emitted_at real not null
+            ) without rowid"""
+        )
+
+    def get(self, unique_key: str) -> tuple[bytes, float] | None:
+        return self.conn.execute(
+            "select fingerprint, emitted_at from fingerprints where unique_key = ?",
+            (unique_key,),
+        ).fetchone()
+
+    def put(self, unique_key: str, fp: bytes):
+        self.conn.execute(
+            "insert or replace into fingerprints values (?, ?, ?)",
+            (unique_key, fp, time()),
+        )
+
+    def close(self, commit: bool = True):
+        if commit:
+            self.conn.commit()
+        self.conn.close()
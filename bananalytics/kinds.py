@@ -7,8 +7,12 @@ class ItemKind(StrEnum):
     Meenabazar_CATEGORIES = auto()
     Meenabazar_LISTING = auto()
     Meenabazar_BRANCH = auto()
+    # Emitted instead of a listing by incremental crawls when nothing stored
+    # about it changed since the last run.
+    Meenabazar_LISTING_UNCHANGED = auto()
 
     Chaldal_CATEGORIES = auto()
     Chaldal_BRANDS = auto()
     Chaldal_LISTING = auto()
     Chaldal_SHOP_METADATA = auto()
+    Chaldal_LISTING_UNCHANGED = auto()
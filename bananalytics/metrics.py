@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+Labels = tuple[tuple[str, str], ...]
+
+# Upper bounds of the histogram buckets, picked by the metric name's suffix.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1 << 10, 1 << 13, 1 << 15, 1 << 17, 1 << 19, 1 << 21, 1 << 23)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Counters and histograms, keyed by metric name and labels. Updates are
+    plain dict operations, so they are cheap enough to leave on everywhere.
+    They take a lock, since the DatabaseSink records from its writer thread
+    while the crawl records on the reactor thread.
+    """
+
+    def __init__(self):
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = tuple(labels.items())
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = tuple(labels.items())
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                buckets = SIZE_BUCKETS if name.endswith("_bytes") else LATENCY_BUCKETS
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def select(self, **labels: str) -> "Registry":
+        """
+        The series carrying all of `labels`, e.g. those of one of the crawls
+        sharing a process.
+
+        >>> registry = Registry()
+        >>> registry.inc("items_total", spider="chaldal", kind="chaldal_listing")
+        >>> registry.inc("items_total", spider="meenabazar", kind="meenabazar_listing")
+        >>> registry.select(spider="chaldal").counters
+        {'items_total': {(('spider', 'chaldal'), ('kind', 'chaldal_listing')): 1}}
+        """
+        wanted = set(labels.items())
+        selected = Registry()
+        for name, values in self.counters.items():
+            for key, value in values.items():
+                if wanted <= set(key):
+                    selected.counters.setdefault(name, {})[key] = value
+        for name, histograms in self.histograms.items():
+            for key, h in histograms.items():
+                if wanted <= set(key):
+                    selected.histograms.setdefault(name, {})[key] = h
+        return selected
+
+    def summary(self) -> dict:
+        """Everything recorded so far, as JSON serializable data."""
+        return {
+            "counters": {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self.counters.items()
+            },
+            "histograms": {
+                name: [
+                    {
+                        "labels": dict(key),
+                        "buckets": list(h.buckets),
+                        "counts": h.counts,
+                        "sum": h.sum,
+                        "count": h.count,
+                    }
+                    for key, h in series.items()
+                ]
+                for name, series in self.histograms.items()
+            },
+        }
+
+    def merge(self, summary: dict):
+        """Add the `summary` of another registry, e.g. of an ETL worker."""
+        for name, series in summary["counters"].items():
+            for entry in series:
+                self.inc(name, entry["value"], **entry["labels"])
+        for name, series in summary["histograms"].items():
+            for entry in series:
+                key = tuple(entry["labels"].items())
+                with self.lock:
+                    histogram = self.histograms.setdefault(name, {}).setdefault(
+                        key, Histogram(tuple(entry["buckets"]))
+                    )
+                    histogram.counts = [
+                        a + b for a, b in zip(histogram.counts, entry["counts"])
+                    ]
+                    histogram.sum += entry["sum"]
+                    histogram.count += entry["count"]
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format.
+
+        >>> registry = Registry()
+        >>> registry.inc("items_total", kind="chaldal_listing")
+        >>> registry.observe("parse_seconds", 0.2, callback="parse")
+        >>> print(registry.render())  # doctest: +ELLIPSIS
+        # TYPE bananalytics_items_total counter
+        bananalytics_items_total{kind="chaldal_listing"} 1
+        # TYPE bananalytics_parse_seconds histogram
+        bananalytics_parse_seconds_bucket{callback="parse",le="0.001"} 0
+        ...
+        bananalytics_parse_seconds_bucket{callback="parse",le="0.25"} 1
+        ...
+        bananalytics_parse_seconds_bucket{callback="parse",le="+Inf"} 1
+        bananalytics_parse_seconds_sum{callback="parse"} 0.2
+        bananalytics_parse_seconds_count{callback="parse"} 1
+        """
+        # Rendered from the HTTP server's thread while the crawl records, so
+        # iterate over copies.
+        lines = []
+        for name, values in list(self.counters.items()):
+            lines.append(f"# TYPE bananalytics_{name} counter")
+            for key, value in list(values.items()):
+                lines.append(f"bananalytics_{name}{format_labels(key)} {value:g}")
+        for name, histograms in list(self.histograms.items()):
+            lines.append(f"# TYPE bananalytics_{name} histogram")
+            for key, h in list(histograms.items()):
+                cumulative = 0
+                bounds = [f"{bound:g}" for bound in h.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, h.counts):
+                    cumulative += count
+                    le = format_labels((*key, ("le", bound)))
+                    lines.append(f"bananalytics_{name}_bucket{le} {cumulative}")
+                lines.append(f"bananalytics_{name}_sum{format_labels(key)} {h.sum:g}")
+                lines.append(f"bananalytics_{name}_count{format_labels(key)} {h.count}")
+        return "\n".join(lines)
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{k}={json.dumps(str(v))}" for k, v in labels) + "}"
+
+
+# Everything in a process records into this one.
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+
+
+def serve(port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve `registry` on http://localhost:<port>/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = (registry.render() + "\n").encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def write_summary(filename: str, registry: Registry = REGISTRY, **extra):
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump({**extra, **registry.summary()}, f, indent=2, default=str)
+        f.write("\n")
+
+
+class Metrics:
+    """
+    Extension recording what the signals tell about a crawl: response sizes
+    and latencies per endpoint, and items scraped and dropped per kind. The
+    spider middleware, preprocess_item and the Unique pipeline record into the
+    same registry. Served on METRICS_PORT while the crawl runs, if set, and
+    written to METRICS_SUMMARY_DIR as JSON once it is over. Every series of a
+    crawl is labelled with its spider, and the summary only holds those of
+    its own, since several crawls can share the process. main.py serves the
+    metrics of all of its crawls itself.
+    """
+
+    def __init__(self, port: int, summary_dir: str, stats):
+        self.port = port
+        self.summary_dir = summary_dir
+        self.stats = stats
+        self.server: ThreadingHTTPServer | None = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        ext = cls(settings.getint("METRICS_PORT"), settings.get("METRICS_SUMMARY_DIR"), crawler.stats)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_dropped, signal=signals.item_dropped)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = datetime.now()
+        if self.port:
+            self.server = serve(self.port)
+            logger.info("serving metrics on http://127.0.0.1:%s/metrics", self.port)
+
+    def response_received(self, response, request, spider):
+        endpoint = endpoint_of(request.url)
+        labels = {"spider": spider.name, "endpoint": endpoint}
+        inc("responses_total", status=str(response.status), **labels)
+        observe("response_bytes", len(response.body), **labels)
+        if "download_latency" in request.meta:
+            observe("download_seconds", request.meta["download_latency"], **labels)
+
+    def item_scraped(self, item, response, spider):
+        inc("items_scraped_total", spider=spider.name, kind=str(getattr(item, "kind", "")))
+
+    def item_dropped(self, item, response, exception, spider):
+        inc("items_dropped_total", spider=spider.name, kind=str(getattr(item, "kind", "")))
+
+    def spider_closed(self, spider, reason):
+        if self.server is not None:
+            self.server.shutdown()
+
+        ended_at = datetime.now()
+        filename = os.path.join(
+            self.summary_dir,
+            f"{spider.name}_{self.started_at:%Y%m%d%H%M%S}_{ended_at:%Y%m%d%H%M%S}.metrics.json",
+        )
+        registry = REGISTRY.select(spider=spider.name)
+        write_summary(
+            filename,
+            registry,
+            spider=spider.name,
+            reason=reason,
+            started_at=self.started_at,
+            ended_at=ended_at,
+            unique_drop_rate=drop_rate(registry),
+            stats=self.stats.get_stats(),
+        )
+        logger.info("wrote metrics summary to %s", filename)
+
+
+def endpoint_of(url: str) -> str:
+    """
+    >>> endpoint_of("https://catalog.chaldal.com/searchPersonalized?x=1")
+    'catalog.chaldal.com/searchPersonalized'
+    """
+    _, _, rest = url.partition("://")
+    return rest.split("?", 1)[0]
+
+
+def drop_rate(registry: Registry) -> dict[str, float]:
+    """Share of the items with a unique key that Unique dropped, per kind."""
+    seen = registry.counters.get("unique_seen_total", {})
+    dropped = registry.counters.get("unique_dropped_total", {})
+    rates = {}
+    for key, count in seen.items():
+        total = count + dropped.get(key, 0)
+        rates[dict(key).get("kind", "")] = dropped.get(key, 0) / total if total else 0.0
+    return rates
@@ -3,8 +3,12 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+from time import perf_counter
+
 from scrapy import signals
 
+from bananalytics import metrics
+
 # useful for handling different item types with a single interface
 # from itemadapter import is_item, ItemAdapter
 
@@ -33,9 +37,49 @@ class bananalyticsSpiderMiddleware:
         # it has processed the response.
 
         # Must return an iterable of Request, or item objects.
-        for i in result:
+
+        # Only the time spent inside the callback counts, not the time the
+        # rest of the chain takes with what it yielded.
+        callback = response.request.callback if response.request else None
+        name = getattr(callback, "__name__", "parse")
+        elapsed = 0.0
+        outputs = 0
+        result = iter(result)
+        while True:
+            started = perf_counter()
+            try:
+                i = next(result)
+            except StopIteration:
+                break
+            finally:
+                elapsed += perf_counter() - started
+            outputs += 1
             yield i
 
+        metrics.observe("parse_seconds", elapsed, spider=spider.name, callback=name)
+        metrics.inc("parse_outputs_total", outputs, spider=spider.name, callback=name)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # Same as process_spider_output(), for async callbacks.
+        callback = response.request.callback if response.request else None
+        name = getattr(callback, "__name__", "parse")
+        elapsed = 0.0
+        outputs = 0
+        result = aiter(result)
+        while True:
+            started = perf_counter()
+            try:
+                i = await anext(result)
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += perf_counter() - started
+            outputs += 1
+            yield i
+
+        metrics.observe("parse_seconds", elapsed, spider=spider.name, callback=name)
+        metrics.inc("parse_outputs_total", outputs, spider=spider.name, callback=name)
+
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
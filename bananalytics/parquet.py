@@ -0,0 +1,119 @@
+import json
+from typing import Any
+
+from scrapy.exporters import BaseItemExporter
+
+from bananalytics.extractors import LISTING_EXTRACTORS
+from bananalytics.incremental import UNCHANGED_KINDS
+from bananalytics.utils import BananlyticsItem
+
+# Key of the Parquet footer entry holding the non-listing items of the run.
+METADATA_KEY = "bananalytics.metadata"
+
+# Listing columns with the pyarrow factory of their type. pyarrow is an
+# optional dependency, Scrapy loads every registered feed exporter even when
+# no feed uses it, so it is only imported once a Parquet feed starts.
+LISTING_COLUMNS = [
+    ("item_id", "string"),
+    ("name", "string"),
+    ("quantity", "float64"),
+    ("unit", "string"),
+    ("stock", "int64"),
+    ("price", "float64"),
+    ("sale_price", "float64"),
+    ("base_quantity", "float64"),
+    ("base_unit", "string"),
+]
+
+COLUMNS = ["kind", "unique_key", "fetched_at", *(name for name, _ in LISTING_COLUMNS)]
+
+UNCHANGED = set(UNCHANGED_KINDS.values())
+
+
+def arrow_schema(raw_payload: bool = False):
+    import pyarrow as pa
+
+    fields = [
+        ("kind", pa.dictionary(pa.int8(), pa.string())),
+        ("unique_key", pa.string()),
+        ("fetched_at", pa.timestamp("us")),
+        *((name, getattr(pa, type_)()) for name, type_ in LISTING_COLUMNS),
+    ]
+    if raw_payload:
+        fields.append(("payload", pa.string()))
+    return pa.schema(fields)
+
+
+class ParquetItemExporter(BaseItemExporter):
+    """
+    Writes a run as one Parquet file: a row per listing with the columns
+    etl.py stores, plus optionally the raw payload as JSON. Rows are written
+    as a row group every `row_group_size` items, so memory stays bounded
+    during the crawl.
+
+    Unchanged markers from incremental crawls become rows with only kind,
+    unique_key and fetched_at set. All other items are run metadata; they are
+    kept as JSON in the file's key-value metadata.
+
+    Registered as the "parquet" feed format, e.g. `-O raw_files/run.parquet`.
+    Options go through the feed's item_export_kwargs. The feed must be
+    overwritten (-O) rather than appended to (-o). Needs the parquet extra,
+    e.g. `uv sync --extra parquet`.
+    """
+
+    def __init__(self, file, *, row_group_size: int = 50_000, raw_payload: bool = False, **kwargs):
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.row_group_size = row_group_size
+        self.raw_payload = raw_payload
+        self.names = [*COLUMNS, "payload"] if raw_payload else COLUMNS
+        self.columns: dict[str, list] = {name: [] for name in self.names}
+        self.metadata: dict[str, list] = {}
+        self.schema = None
+        self.writer = None
+
+    def start_exporting(self):
+        import pyarrow.parquet as pq
+
+        self.schema = arrow_schema(self.raw_payload)
+        self.writer = pq.ParquetWriter(self.file, self.schema, compression="zstd")
+
+    def export_item(self, item: BananlyticsItem):
+        extract = LISTING_EXTRACTORS.get(item.kind)
+        values: tuple[Any, ...]
+        if extract is not None:
+            values = extract(item.payload)
+        elif item.kind in UNCHANGED:
+            values = (None,) * len(LISTING_COLUMNS)
+        else:
+            self.metadata.setdefault(item.kind, []).append(item.payload)
+            return
+
+        columns = self.columns
+        columns["kind"].append(item.kind.value)
+        columns["unique_key"].append(item.unique_key)
+        columns["fetched_at"].append(item.date)
+        for (name, _), value in zip(LISTING_COLUMNS, values):
+            columns[name].append(value)
+        if "payload" in columns:
+            columns["payload"].append(json.dumps(item.payload, ensure_ascii=False))
+
+        if len(columns["kind"]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+
+        assert self.writer is not None
+        if not self.columns["kind"]:
+            return
+        self.writer.write_batch(pa.record_batch(self.columns, schema=self.schema))
+        self.columns = {name: [] for name in self.names}
+
+    def finish_exporting(self):
+        assert self.writer is not None
+        self.flush()
+        self.writer.add_key_value_metadata(
+            {METADATA_KEY: json.dumps(self.metadata, ensure_ascii=False)}
+        )
+        self.writer.close()
@@ -8,9 +8,24 @@
 # from itemadapter import ItemAdapter
 
 
-from scrapy.exceptions import DropItem
+import asyncio
+import logging
+import os
+import queue
+import threading
+import uuid
+from datetime import datetime
+from time import monotonic, time
 
-from bananalytics.utils import BananlyticsModel
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.exporters import JsonLinesItemExporter
+from twisted.internet.threads import deferToThread
+
+from bananalytics import dedup, metrics
+from bananalytics.extractors import LISTING_EXTRACTORS
+from bananalytics.incremental import UNCHANGED_KINDS, FingerprintStore, fingerprint
+from bananalytics.utils import BananlyticsItem
 
 
 class bananalyticsPipeline:
@@ -19,16 +34,307 @@ class bananalyticsPipeline:
 
 
 class Unique:
-    def __init__(self):
-        self.ids_seen = set()
+    def __init__(self, ids_seen: dedup.Deduplicator | None = None, stats=None):
+        self.ids_seen = ids_seen if ids_seen is not None else dedup.HashDeduplicator()
+        self.stats = stats
+        self.dropped = 0
+        # Per kind, handed to the metrics registry when the spider closes.
+        self.seen_kinds: dict[str, int] = {}
+        self.dropped_kinds: dict[str, int] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(dedup.from_settings(crawler.settings), crawler.stats)
 
-    def process_item(self, item: BananlyticsModel, _):
+    def process_item(self, item: BananlyticsItem, _):
         if item.unique_key is None:
             return item
 
-        if item.unique_key in self.ids_seen:
-            raise DropItem()
+        if not self.ids_seen.add(item.unique_key):
+            self.dropped += 1
+            self.dropped_kinds[item.kind] = self.dropped_kinds.get(item.kind, 0) + 1
+            raise DropItem(f"duplicate item {item.unique_key}")
+
+        self.seen_kinds[item.kind] = self.seen_kinds.get(item.kind, 0) + 1
+        return item
+
+    def close_spider(self, spider):
+        for kind, count in self.seen_kinds.items():
+            metrics.inc("unique_seen_total", count, spider=spider.name, kind=kind)
+        for kind, count in self.dropped_kinds.items():
+            metrics.inc("unique_dropped_total", count, spider=spider.name, kind=kind)
+
+        if self.stats is None:
+            return
+        self.stats.set_value("unique/backend", type(self.ids_seen).__name__)
+        self.stats.set_value("unique/seen", len(self.ids_seen))
+        self.stats.set_value("unique/dropped", self.dropped)
+        self.stats.set_value("unique/memory_bytes", self.ids_seen.memory_bytes())
+
+
+class Incremental:
+    """
+    Replace listings whose stored fields haven't changed since the last run
+    with tiny *_LISTING_UNCHANGED markers, so a run's output mostly holds what
+    actually moved. A listing is still emitted in full once its last full
+    emission is older than INCREMENTAL_MAX_AGE seconds.
+    """
+
+    def __init__(self, store_dir: str, max_age: float, stats=None):
+        self.store_dir = store_dir
+        self.max_age = max_age
+        self.stats = stats
+        self.store: FingerprintStore | None = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("INCREMENTAL_ENABLED"):
+            raise NotConfigured
+        pipeline = cls(
+            settings.get("INCREMENTAL_STORE_DIR"),
+            settings.getfloat("INCREMENTAL_MAX_AGE"),
+            crawler.stats,
+        )
+        # Pipelines are closed without the reason, the signal has it.
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.store = FingerprintStore(
+            os.path.join(self.store_dir, f"{spider.name}.sqlite3")
+        )
 
-        self.ids_seen.add(item.unique_key)
+    def spider_closed(self, spider, reason):
+        # Only a finished crawl has written out every item it fingerprinted.
+        if self.store is not None:
+            self.store.close(commit=reason == "finished")
 
+    def process_item(self, item: BananlyticsItem, _):
+        unchanged_kind = UNCHANGED_KINDS.get(item.kind)
+        if unchanged_kind is None or item.unique_key is None:
+            return item
+
+        assert self.store is not None
+        fp = fingerprint(item.kind, item.payload)
+        known = self.store.get(item.unique_key)
+        if known is not None and known[0] == fp and time() - known[1] < self.max_age:
+            if self.stats is not None:
+                self.stats.inc_value("incremental/unchanged")
+            return BananlyticsItem(
+                payload={"fingerprint": fp.hex()},
+                date=item.date,
+                kind=unchanged_kind,
+                unique_key=item.unique_key,
+            )
+
+        self.store.put(item.unique_key, fp)
+        if self.stats is not None:
+            self.stats.inc_value("incremental/new" if known is None else "incremental/changed")
         return item
+
+
+logger = logging.getLogger(__name__)
+
+UNCHANGED = set(UNCHANGED_KINDS.values())
+
+# Tells the writer thread of DatabaseSink that the crawl is over.
+_STOP = object()
+
+
+class DatabaseSink:
+    """
+    Load listings into the database while the crawl runs, instead of running
+    etl.py over the finished file. Rows are handed to a writer thread through
+    a bounded queue and written in batches of DATABASE_SINK_BATCH_SIZE rows,
+    or whatever arrived within DATABASE_SINK_FLUSH_INTERVAL seconds. When the
+    database can't keep up the queue fills and items wait for room, which
+    holds up the scraper instead of buffering without limit.
+
+    Every item is also written to a jsonlines file in DATABASE_SINK_ARCHIVE_DIR,
+    renamed to the usual <vendor>_<start>_<end>_<run id>.jsonlines once the
+    crawl is over. The run is marked complete, so etl.py skips that file.
+    """
+
+    def __init__(
+        self,
+        dsn: str | None,
+        batch_size: int,
+        flush_interval: float,
+        queue_size: int,
+        engine: str,
+        archive_dir: str,
+        stats=None,
+    ):
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.engine = engine
+        self.archive_dir = archive_dir
+        self.stats = stats
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.error: BaseException | None = None
+        # Listings Incremental replaced with markers, written from their
+        # stored rows once the crawl is over.
+        self.unchanged: dict[str, datetime] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("DATABASE_SINK_ENABLED"):
+            raise NotConfigured
+        return cls(
+            settings.get("DATABASE_SINK_DSN"),
+            settings.getint("DATABASE_SINK_BATCH_SIZE"),
+            settings.getfloat("DATABASE_SINK_FLUSH_INTERVAL"),
+            settings.getint("DATABASE_SINK_QUEUE_SIZE"),
+            settings.get("DATABASE_SINK_ENGINE"),
+            settings.get("DATABASE_SINK_ARCHIVE_DIR"),
+            crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        # etl.py is a script at the project root and pulls in psycopg, so it
+        # is only imported by crawls that use this pipeline.
+        import psycopg
+
+        import etl
+
+        self.etl = etl
+        self.run = etl.Run(
+            run_id=uuid.uuid4().hex[:7],
+            vendor=spider.name,
+            metadata={},
+            started_at=datetime.now().replace(microsecond=0),
+            ended_at=None,
+        )
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.archive_name = os.path.join(self.archive_dir, f"{self.run.run_id}.jsonlines")
+        self.archive = open(self.archive_name, "wb")
+        self.exporter = JsonLinesItemExporter(self.archive)
+        self.exporter.start_exporting()
+
+        self.conn = psycopg.connect(self.dsn)
+        etl.create_partitions(self.conn, self.run.started_at, self.run.started_at)
+        run_id = etl.start_run(self.conn, self.run)
+        assert run_id is not None
+        self.run_id = run_id
+
+        self.writer = threading.Thread(target=self.write_batches, name="database-sink")
+        self.writer.start()
+
+    async def process_item(self, item: BananlyticsItem, spider):
+        self.exporter.export_item(item)
+
+        extract = LISTING_EXTRACTORS.get(item.kind)
+        if extract is None:
+            if item.kind in UNCHANGED and item.unique_key is not None:
+                self.unchanged[item.unique_key] = item.date
+            return item
+        values = extract(item.payload)
+        if values[5] == 0:
+            self.etl.skip_zero_price(item.kind, values[0])
+            return item
+
+        row = (*values, item.unique_key, item.date)
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            if self.stats is not None:
+                self.stats.inc_value("database_sink/backpressure")
+            await asyncio.to_thread(self.queue.put, row)
+        return item
+
+    def write_batches(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self.queue.get(timeout=max(0, deadline - monotonic()))
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            # After a failure the queue is still drained, so the crawl isn't
+            # blocked forever. The archive has everything for etl.py.
+            if not batch or self.error is not None:
+                continue
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.exception("writing to the database failed, only archiving from now on")
+                self.error = e
+                self.conn.rollback()
+
+        if self.error is None:
+            try:
+                with self.conn.cursor() as cur:
+                    self.etl.insert_unchanged(cur, self.run.vendor, self.run_id, self.unchanged)
+                    self.etl.update_serving_tables(cur, self.run_id)
+                    cur.execute(
+                        "update runs set ended_at = %s, completed_at = now() where id = %s",
+                        (self.run.ended_at, self.run_id),
+                    )
+                self.conn.commit()
+            except Exception as e:
+                logger.exception("finishing run %s failed", self.run.run_id)
+                self.error = e
+                self.conn.rollback()
+        if self.error is not None:
+            self.discard_run()
+        self.conn.close()
+
+    def discard_run(self):
+        # Leave nothing behind, so etl.py can load the archive as a new run
+        # instead of resuming one it never checkpointed.
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("delete from datapoints where run_id = %s", (self.run_id,))
+                cur.execute("delete from runs where id = %s", (self.run_id,))
+            self.conn.commit()
+        except Exception:
+            logger.exception(
+                "removing the partial run %s failed, delete it before loading its file",
+                self.run.run_id,
+            )
+
+    def write(self, batch: list):
+        # The crawl can run into the next month.
+        last = batch[-1][-1]
+        self.etl.create_partitions(self.conn, last, last)
+        with self.conn.cursor() as cur:
+            count = self.etl.ENGINES[self.engine](cur, self.run_id, batch, self.batch_size)
+        self.conn.commit()
+        if self.stats is not None:
+            self.stats.inc_value("database_sink/rows", count)
+
+    def close_spider(self, spider):
+        self.run.ended_at = datetime.now().replace(microsecond=0)
+        return deferToThread(self.finish)
+
+    def finish(self):
+        self.queue.put(_STOP)
+        self.writer.join()
+
+        self.exporter.finish_exporting()
+        self.archive.close()
+        stamp = "%Y%m%d%H%M%S"
+        os.rename(
+            self.archive_name,
+            os.path.join(
+                self.archive_dir,
+                f"{self.run.vendor}_{self.run.started_at:{stamp}}_{self.run.ended_at:{stamp}}_{self.run.run_id}.jsonlines",
+            ),
+        )
+        if self.error is not None:
+            logger.error(
+                "run %s did not fully make it into the database, load its file with etl.py",
+                self.run.run_id,
+            )
@@ -0,0 +1,301 @@
+import cProfile
+import importlib
+import inspect
+import logging
+import os
+import pstats
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+# Only one cProfile profiler can be enabled at a time, so when a profiled
+# function calls another one the outer profiler is paused until the inner
+# one returns. Each target then only counts the time outside of the others.
+_active: list[cProfile.Profile] = []
+
+
+def _enter(profile: cProfile.Profile):
+    if _active:
+        _active[-1].disable()
+    _active.append(profile)
+    profile.enable()
+
+
+def _exit(profile: cProfile.Profile):
+    profile.disable()
+    _active.pop()
+    if _active:
+        _active[-1].enable()
+
+
+def profiled(fn, profile: cProfile.Profile):
+    """
+    Wrap `fn` so that it runs under `profile`. Generator functions, like
+    spider callbacks, are profiled a step at a time, so the consumer of what
+    they yield is left out.
+    """
+    if inspect.isgeneratorfunction(fn):
+
+        @wraps(fn)
+        def generator(*args, **kwargs):
+            gen = fn(*args, **kwargs)
+            while True:
+                _enter(profile)
+                try:
+                    value = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    _exit(profile)
+                yield value
+
+        return generator
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        _enter(profile)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _exit(profile)
+
+    return wrapper
+
+
+def run_prefix(filename: str) -> str:
+    """
+    The path of a run file without any of its extensions. Profiles of the run
+    are written next to it as <prefix>.<name>.pstats and .collapsed.
+
+    >>> run_prefix("raw_files/chaldal_20250101000000_20250101010000_abc1234.jsonlines.gz")
+    'raw_files/chaldal_20250101000000_20250101010000_abc1234'
+    """
+    return os.path.join(os.path.dirname(filename), os.path.basename(filename).split(".", 1)[0])
+
+
+def feed_path(feeds: dict) -> str | None:
+    """
+    The local file the first feed of a crawl writes to, if it is one. Feed
+    URIs with placeholders are only filled in by the feed exporter, so those
+    are left out.
+
+    >>> feed_path({"raw_files/chaldal_abc1234.jsonlines.gz": {"format": "jsonlines"}})
+    'raw_files/chaldal_abc1234.jsonlines.gz'
+    >>> feed_path({"s3://bucket/%(name)s.jsonlines": {}}) is None
+    True
+    """
+    for uri in feeds:
+        uri = str(uri).removeprefix("file://")
+        if "://" not in uri and "%(" not in uri:
+            return uri
+    return None
+
+
+def resolve(target: str) -> list[tuple[str, object, str]]:
+    """
+    Find what a dotted path like "bananalytics.pipelines.Unique.process_item"
+    points at, as (name, owner, attribute) triples. A class stands for all of
+    the functions it defines.
+
+    >>> [(name, attr) for name, _, attr in resolve("bananalytics.pipelines.Unique.process_item")]
+    [('Unique.process_item', 'process_item')]
+    >>> len(resolve("bananalytics.dedup.HashDeduplicator"))
+    6
+    """
+    parts = target.split(".")
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            obj = importlib.import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        owner = obj
+        for part in parts[i:]:
+            owner, obj = obj, getattr(obj, part)
+        break
+    else:
+        raise ValueError("can't import profile target", target)
+
+    if inspect.isclass(obj):
+        return [
+            (f"{obj.__name__}.{attr}", obj, attr)
+            for attr, value in vars(obj).items()
+            if inspect.isfunction(value)
+        ]
+    name = f"{owner.__name__}.{parts[-1]}" if inspect.isclass(owner) else parts[-1]
+    return [(name, owner, parts[-1])]
+
+
+def spider_targets(targets: list[tuple[str, object, str]], spidercls: type) -> list[str]:
+    """
+    The names of the `targets` defined in the module of `spidercls`, which
+    only its crawls run. The others, like pipelines, are shared by every
+    crawl of a process.
+
+    >>> from bananalytics.spiders.chaldal import ChaldalSpider
+    >>> from bananalytics.spiders.meenabazar import MeenabazarSpider
+    >>> targets = resolve("bananalytics.spiders.meenabazar.MeenabazarSpider.parse_listing")
+    >>> spider_targets(targets, MeenabazarSpider), spider_targets(targets, ChaldalSpider)
+    (['MeenabazarSpider.parse_listing'], [])
+    """
+    return [
+        name
+        for name, owner, _ in targets
+        if getattr(owner, "__module__", getattr(owner, "__name__", None)) == spidercls.__module__
+    ]
+
+
+class ProfileSession:
+    """
+    Profile the functions `attribute` of `owner` under `name`, by replacing
+    them with profiled wrappers between `start` and `stop`. Nothing is
+    patched, so nothing costs anything, unless a session is started.
+    """
+
+    def __init__(self, targets: list[tuple[str, object, str]]):
+        self.targets = targets
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self.originals: list[tuple[object, str, object]] = []
+
+    def start(self):
+        for name, owner, attr in self.targets:
+            original = vars(owner)[attr]
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            setattr(owner, attr, profiled(original, profile))
+            self.originals.append((owner, attr, original))
+
+    def stop(self):
+        for owner, attr, original in reversed(self.originals):
+            setattr(owner, attr, original)
+        self.originals.clear()
+
+    def dump(self, prefix: str, names: list[str] | None = None) -> list[str]:
+        """
+        Write <prefix>.<name>.pstats and <prefix>.<name>.collapsed for every
+        target that ran, or only for those in `names`, returning the files
+        written.
+        """
+        written = []
+        for name, profile in self.profiles.items():
+            if names is not None and name not in names:
+                continue
+            profile.create_stats()
+            if not profile.stats:  # type: ignore[attr-defined]
+                continue
+            stats = pstats.Stats(profile)
+            stats.dump_stats(f"{prefix}.{name}.pstats")
+            with open(f"{prefix}.{name}.collapsed", "w") as f:
+                for line in collapsed_stacks(stats):
+                    f.write(line + "\n")
+            written += [f"{prefix}.{name}.pstats", f"{prefix}.{name}.collapsed"]
+        return written
+
+
+def collapsed_stacks(stats: pstats.Stats, max_depth: int = 64) -> list[str]:
+    """
+    Approximate the call stacks of a profile in the collapsed format that
+    flamegraph.pl and speedscope read, one "root;caller;callee microseconds"
+    line per stack. cProfile only records caller/callee pairs, so the time
+    of a function is split between its callers by how much each one spent
+    calling it.
+    """
+    entries = stats.stats  # type: ignore[attr-defined]
+    children: dict = defaultdict(dict)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, cumtime) in callers.items():
+            children[caller][func] = cumtime
+
+    def label(func) -> str:
+        filename, line, name = func
+        if filename == "~":
+            return name
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    total = sum(tottime for _, _, tottime, _, _ in entries.values())
+    threshold = total * 1e-4
+    stacks: dict[str, float] = defaultdict(float)
+
+    def walk(func, path: list, seen: set, time: float):
+        _, _, tottime, cumtime, _ = entries[func]
+        scale = time / cumtime if cumtime else 0.0
+        own = tottime * scale
+        if own > 0:
+            stacks[";".join(path)] += own
+        if len(path) >= max_depth:
+            return
+        for child, edge_time in children[func].items():
+            child_time = edge_time * scale
+            if child in seen or child not in entries or child_time < threshold:
+                continue
+            seen.add(child)
+            walk(child, [*path, label(child)], seen, child_time)
+            seen.discard(child)
+
+    # Leave out the wrappers' own bookkeeping, like the profiler's disable().
+    roots = [
+        func
+        for func, (_, _, _, _, callers) in entries.items()
+        if not any(caller in entries for caller in callers) and func[0] != __file__
+    ]
+    for root in roots:
+        walk(root, [label(root)], {root}, entries[root][3])
+
+    return [
+        f"{stack} {round(seconds * 1e6)}"
+        for stack, seconds in stacks.items()
+        if round(seconds * 1e6) > 0
+    ]
+
+
+class Profiling:
+    """
+    Extension profiling the functions named in PROFILE_TARGETS with cProfile
+    for a whole crawl, e.g.
+
+        scrapy crawl chaldal -s PROFILE_TARGETS=bananalytics.spiders.chaldal.ChaldalSpider.parse_listings
+
+    Profiles are written next to the crawl's feed file once the spider
+    closes, named after it like etl.py names its profiles. Crawls without a
+    local feed file write them to PROFILE_DIR instead. Without targets the
+    extension is not even loaded. main.py profiles all of its crawls itself,
+    from before the first one starts until the last one is over.
+    """
+
+    def __init__(self, session: ProfileSession, directory: str, output: str | None = None):
+        self.session = session
+        self.directory = directory
+        self.output = output
+        self.started_at = datetime.now()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        targets = crawler.settings.getlist("PROFILE_TARGETS")
+        if not targets:
+            raise NotConfigured
+        session = ProfileSession([t for target in targets for t in resolve(target)])
+        # Before the engine exists, so the pipelines pick up the wrappers.
+        session.start()
+        ext = cls(
+            session,
+            crawler.settings.get("PROFILE_DIR"),
+            feed_path(crawler.settings.getdict("FEEDS")),
+        )
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_closed(self, spider):
+        self.session.stop()
+        if self.output is not None:
+            prefix = run_prefix(self.output)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            prefix = os.path.join(
+                self.directory,
+                f"{spider.name}_{self.started_at:%Y%m%d%H%M%S}_{datetime.now():%Y%m%d%H%M%S}",
+            )
+        for filename in self.session.dump(prefix):
+            logger.info("wrote profile %s", filename)
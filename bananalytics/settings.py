@@ -30,6 +30,36 @@ ROBOTSTXT_OBEY = True
 # DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
 CONCURRENT_REQUESTS_PER_DOMAIN = 6
+# Per host budgets, overriding CONCURRENT_REQUESTS_PER_DOMAIN. The homepage
+# is fetched once a run; the listings are where the requests go.
+DOWNLOAD_SLOTS = {
+    "chaldal.com": {"concurrency": 1},
+    "catalog.chaldal.com": {"concurrency": 8},
+    "meenabazardev.com": {"concurrency": 6},
+}
+
+# Largest page ChaldalSpider asks searchPersonalized for.
+CHALDAL_PAGE_SIZE = 250
+# What ChaldalSpider needs from the homepage (API key, categories, brands and
+# areas), kept for CHALDAL_BOOTSTRAP_TTL seconds so runs within it neither
+# fetch nor parse the homepage again.
+CHALDAL_BOOTSTRAP_FILE = "raw_files/chaldal_bootstrap.json"
+CHALDAL_BOOTSTRAP_TTL = 6 * 3600
+
+# MeenabazarSpider finds branches by searching delivery areas, starting from
+# single letters. A prefix returning as many results as the search returns at
+# most is taken as truncated and searched again one letter longer. The search
+# doesn't tell how many results it cuts off at, so by default (0) the most
+# results any search returned so far is used. Set a number if the cap is known.
+MEENABAZAR_AREA_SEARCH_LIMIT = 0
+# Prefixes this long that still look truncated are logged and counted in the
+# meenabazar/truncated_area_searches stat instead.
+MEENABAZAR_AREA_PREFIX_MAX_LENGTH = 3
+# Branches known from earlier runs, crawled without waiting for the search.
+# Rewritten after every run with the branches its searches returned.
+MEENABAZAR_SUBUNITS_FILE = "raw_files/meenabazar_subunits.json"
+# Items per request for the pages after the first one of a category listing.
+MEENABAZAR_PAGE_SIZE = 100
 # CONCURRENT_REQUESTS_PER_IP = 16
 
 # Disable cookies (enabled by default)
@@ -48,29 +78,84 @@ TELNETCONSOLE_PASSWORD = "cmom"
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    "bananalytics.middlewares.bananalyticsSpiderMiddleware": 543,
-# }
+SPIDER_MIDDLEWARES = {
+    "bananalytics.middlewares.bananalyticsSpiderMiddleware": 543,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    "bananalytics.middlewares.bananalyticsDownloaderMiddleware": 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    #    "bananalytics.middlewares.bananalyticsDownloaderMiddleware": 543,
+    # Stores revalidated responses again, see HTTPCACHE_ENABLED below.
+    "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": None,
+    "bananalytics.httpcache.RefreshingHttpCacheMiddleware": 900,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-# }
+EXTENSIONS = {
+    #    "scrapy.extensions.telnet.TelnetConsole": None,
+    "bananalytics.metrics.Metrics": 500,
+    "bananalytics.profiling.Profiling": 510,
+}
+
+# Per kind item counts, per callback parse times and per endpoint response
+# sizes and latencies. Written to METRICS_SUMMARY_DIR as JSON after every
+# crawl, and served for Prometheus on http://127.0.0.1:METRICS_PORT/metrics
+# during it if METRICS_PORT is set.
+METRICS_ENABLED = True
+METRICS_PORT = 0
+METRICS_SUMMARY_DIR = "raw_files/metrics"
+
+# Dotted paths of functions, or classes for all of their methods, to profile
+# with cProfile, e.g. "bananalytics.spiders.chaldal.ChaldalSpider.parse_listings"
+# or "bananalytics.pipelines.Unique". Every target gets a .pstats and a
+# flamegraph compatible .collapsed file per crawl, next to the feed file as
+# <run>.<target>.pstats, or in PROFILE_DIR for crawls without one.
+PROFILE_TARGETS: list[str] = []
+PROFILE_DIR = "raw_files/profiles"
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     "bananalytics.pipelines.bananalyticsPipeline": 300,
     "bananalytics.pipelines.Unique": 500,
+    "bananalytics.pipelines.Incremental": 600,
+    "bananalytics.pipelines.DatabaseSink": 700,
 }
 
+# How the Unique pipeline remembers the keys it has seen:
+# - "set": exact, stores every key string
+# - "hash": 64-bit key hashes in an open addressing table, 8 bytes per key
+# - "bloom": fixed size Bloom filter, may drop a small share of new items
+# Memory used and duplicates dropped end up in the crawl stats as unique/*.
+UNIQUE_BACKEND = "hash"
+UNIQUE_BLOOM_CAPACITY = 2_000_000
+UNIQUE_BLOOM_ERROR_RATE = 1e-4
+
+# Incremental crawls: listings whose stored fields are unchanged since the last
+# run are written as small "unchanged" markers instead of in full. The last
+# fingerprint of every listing is kept per spider in INCREMENTAL_STORE_DIR.
+INCREMENTAL_ENABLED = False
+INCREMENTAL_STORE_DIR = "raw_files/fingerprints"
+# Emit a listing in full at least this often (seconds), even if unchanged.
+INCREMENTAL_MAX_AGE = 7 * 24 * 3600
+
+# Load listings into the database during the crawl. Everything is archived to
+# DATABASE_SINK_ARCHIVE_DIR as jsonlines too, as if crawled with -o. Like
+# etl.py --dsn, an empty DSN connects through libpq's PG* environment
+# variables.
+DATABASE_SINK_ENABLED = False
+DATABASE_SINK_DSN = ""
+DATABASE_SINK_BATCH_SIZE = 5000
+# Seconds a row may wait for its batch to fill up.
+DATABASE_SINK_FLUSH_INTERVAL = 5.0
+# Rows waiting for the database before items have to wait for room.
+DATABASE_SINK_QUEUE_SIZE = 20_000
+# "insert" or "copy", as with etl.py --engine.
+DATABASE_SINK_ENGINE = "copy"
+DATABASE_SINK_ARCHIVE_DIR = "raw_files"
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 AUTOTHROTTLE_ENABLED = True
@@ -86,16 +171,35 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 0.5
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED = True
-# HTTPCACHE_EXPIRATION_SECS = 0
-# HTTPCACHE_DIR = "httpcache"
-# HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# Responses that barely change between runs are kept on disk across runs, so
+# the request budget goes to the listings. Only endpoints listed here are
+# cached, keyed by "host/path" prefix, with a TTL in seconds; stale entries are
+# revalidated with ETag/Last-Modified when the vendor sends them.
+HTTPCACHE_ENABLED = True
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_POLICY = "bananalytics.httpcache.EndpointTTLPolicy"
+HTTPCACHE_STORAGE = "bananalytics.httpcache.BoundedFilesystemCacheStorage"
+HTTPCACHE_GZIP = True
+HTTPCACHE_ENDPOINT_TTLS = {
+    "meenabazardev.com/api/front/areas/search": 7 * 24 * 3600,
+    "meenabazardev.com/api/front/store/picup/name": 7 * 24 * 3600,
+    "meenabazardev.com/api/front/nav/categories/list": 24 * 3600,
+    "meenabazardev.com/robots.txt": 24 * 3600,
+    "catalog.chaldal.com/robots.txt": 24 * 3600,
+    # Not the Chaldal homepage: ChaldalSpider keeps what it needs from it in
+    # CHALDAL_BOOTSTRAP_FILE.
+}
+# Per spider, least recently stored entries are evicted after the crawl.
+HTTPCACHE_MAX_BYTES = 512 * 1024 * 1024
 
 # Set settings whose default value is deprecated to a future-proof value
 # REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
+# Columnar alternative to jsonlines, e.g. `-O raw_files/<run>.parquet`.
+FEED_EXPORTERS = {
+    "parquet": "bananalytics.parquet.ParquetItemExporter",
+}
 LOG_LEVEL = INFO
 
 LOG_FORMATTER = "bananalytics.log_formatter.PoliteLogFormatter"
@@ -1,92 +1,352 @@
 import json
+import math
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from time import time
 
 import scrapy
 from scrapy.http.request.json_request import JsonRequest
 from scrapy.http.response import Response
+from scrapy.spidermiddlewares.httperror import HttpError
 
 from bananalytics.kinds import ItemKind
 from bananalytics.utils import preprocess_item
 
 
+def plan_pages(hits: int, max_page_size: int) -> tuple[int, int]:
+    """
+    Number of pages and page size to fetch a category of `hits` items with:
+    evenly sized pages instead of full pages and a short tail. Pages get a
+    little headroom since warehouses don't all carry exactly the same items.
+
+    >>> plan_pages(40, 250)
+    (1, 42)
+    >>> plan_pages(300, 250)
+    (2, 158)
+    >>> plan_pages(1000, 250)
+    (4, 250)
+    >>> plan_pages(0, 250)
+    (1, 250)
+    """
+    if hits == 0:
+        return 1, max_page_size
+    pages = math.ceil(hits / max_page_size)
+    return pages, min(max_page_size, math.ceil(hits * 1.05 / pages))
+
+
+# The homepage's top level services the crawl needs, and the search API key,
+# which sits somewhere in the page as a JSON encoded string.
+BOOTSTRAP_PATTERN = re.compile(
+    r'"(LogicService|CategoryService|RouterService)"\s*:\s*|apiKey\W*(\w+)'
+)
+SERVICE_STATE = "window.__serviceState"
+
+
+@dataclass
+class Bootstrap:
+    """What the crawl needs from the homepage."""
+
+    api_key: str
+    shop_metadata: dict
+    categories: list[dict]
+    brands: list[dict]
+
+
+def parse_bootstrap(text: str) -> Bootstrap:
+    """
+    Find the services and the API key in the homepage with one pass of
+    BOOTSTRAP_PATTERN, decoding only the services' subtrees instead of the
+    whole service state.
+
+    >>> page = (
+    ...     '<script>window.__serviceState = {"RouterService": {"manufacturerRoutes": {"1": []}},'
+    ...     ' "CategoryService": {"categories": {"1": [{"Id": 7}]}},'
+    ...     ' "LogicService": {"globalConstants": [{"Areas": {}}]},'
+    ...     ' "ConfigService": "{\\"apiKey\\":\\"d0e1f2\\"}"}</script>'
+    ... )
+    >>> parse_bootstrap(page)
+    Bootstrap(api_key='d0e1f2', shop_metadata={'Areas': {}}, categories=[{'Id': 7}], brands=[])
+    """
+    start = text.find(SERVICE_STATE)
+    if start == -1:
+        raise ValueError("no service state in the homepage")
+
+    decoder = json.JSONDecoder()
+    services: dict[str, dict] = {}
+    api_key = None
+    for match in BOOTSTRAP_PATTERN.finditer(text):
+        service, key = match.groups()
+        if key is not None:
+            api_key = api_key or key
+        elif match.start() > start and service not in services:
+            services[service], _ = decoder.raw_decode(text, match.end())
+        if api_key is not None and len(services) == 3:
+            break
+
+    if api_key is None or len(services) != 3:
+        raise ValueError("incomplete homepage", api_key is not None, sorted(services))
+    return Bootstrap(
+        api_key=api_key,
+        shop_metadata=services["LogicService"]["globalConstants"][0],
+        categories=services["CategoryService"]["categories"]["1"],  # "1" is the storeId
+        brands=services["RouterService"]["manufacturerRoutes"]["1"],
+    )
+
+
 class ChaldalSpider(scrapy.Spider):
     name = "chaldal"
     allowed_domains = ["chaldal.com"]
     start_urls = ["https://chaldal.com"]
     api_key = ""
+    # Listing requests rejected while a new API key is fetched, or None when
+    # no fetch is under way, and whether this run fetched one already.
+    rejected: list[JsonRequest] | None = None
+    api_key_refreshed = False
 
-    def parse(self, response: Response):
-        window_service_state_script = response.css("body > script::text")[0]
-        json_payload = window_service_state_script.extract().replace(
-            "window.__serviceState = ", "", 1
+    def start_requests(self):
+        # A recent enough bootstrap, e.g. from a parallel run, is used as is.
+        # Callbacks need a response to run from, so it goes through an
+        # empty data: request.
+        bootstrap = self.load_bootstrap()
+        if bootstrap is None:
+            for url in self.start_urls:
+                yield scrapy.Request(url, dont_filter=True)
+            return
+        self.crawler.stats.inc_value("chaldal/bootstrap_cached")
+        yield scrapy.Request(
+            "data:,",
+            callback=self.parse_cached_bootstrap,
+            cb_kwargs={"bootstrap": bootstrap},
+            dont_filter=True,
         )
 
-        payload = json.loads(json_payload)
+    def load_bootstrap(self) -> Bootstrap | None:
+        filename = self.settings.get("CHALDAL_BOOTSTRAP_FILE")
+        ttl = self.settings.getint("CHALDAL_BOOTSTRAP_TTL")
+        if not filename or not os.path.exists(filename):
+            return None
+        if time() - os.path.getmtime(filename) >= ttl:
+            return None
+        with open(filename) as f:
+            return Bootstrap(**json.load(f))
 
-        shop_metadata = payload["LogicService"]["globalConstants"][0]
-        yield preprocess_item(shop_metadata, ItemKind.Chaldal_SHOP_METADATA)
+    def save_bootstrap(self, bootstrap: Bootstrap):
+        filename = self.settings.get("CHALDAL_BOOTSTRAP_FILE")
+        if not filename:
+            return
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        # Renamed into place, so parallel runs never read half a file.
+        tmp = f"{filename}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(asdict(bootstrap), f)
+        os.replace(tmp, filename)
 
-        categories = payload["CategoryService"]["categories"]["1"]  # "1" is the storeId
-        yield preprocess_item(categories, ItemKind.Chaldal_CATEGORIES)
+    def parse(self, response: Response):
+        bootstrap = parse_bootstrap(response.text)
+        self.save_bootstrap(bootstrap)
+        yield from self.start_crawl(bootstrap)
+
+    def parse_cached_bootstrap(self, response: Response, bootstrap: Bootstrap):
+        yield from self.start_crawl(bootstrap)
 
-        brands = payload["RouterService"]["manufacturerRoutes"]["1"]
-        yield preprocess_item(brands, ItemKind.Chaldal_BRANDS)
+    def start_crawl(self, bootstrap: Bootstrap):
+        shop_metadata = bootstrap.shop_metadata
+        categories = bootstrap.categories
+        now = datetime.now()
+        yield preprocess_item(shop_metadata, ItemKind.Chaldal_SHOP_METADATA, now)
+        yield preprocess_item(categories, ItemKind.Chaldal_CATEGORIES, now)
+        yield preprocess_item(bootstrap.brands, ItemKind.Chaldal_BRANDS, now)
 
-        idx = response.body.find(b"apiKey")
-        self.api_key = response.body[idx + 15 : idx + 79].decode()
+        self.api_key = bootstrap.api_key
 
+        # Each category is probed with one warehouse first. Its size then
+        # decides how the category is paged for all the other warehouses.
+        areas = list(shop_metadata["Areas"].values())
+        page_size = self.settings.getint("CHALDAL_PAGE_SIZE")
         for category in categories:
-            if not category["ContainsProducts"]:
+            if not category["ContainsProducts"] or not areas:
                 continue
-            for area in shop_metadata["Areas"].values():
-                data = {
-                    "apiKey": self.api_key,
-                    "storeId": 1,
-                    "warehouseId": area["WarehouseId"],
-                    "pageSize": 250,
-                    "currentPageIndex": 0,
-                    "metropolitanAreaId": area["MetropolitanAreaId"],
-                    "query": "",
-                    "productVariantId": -1,
-                    "bundleId": {"case": "None"},
-                    "canSeeOutOfStock": "true",
-                    "maxOutOfStockCount": {"case": "Some", "fields": [250]},
-                    "filters": ["categories%3D" + str(category["Id"])],
-                    "shouldShowAlternateProductsForAllOutOfStock": {
-                        "case": "Some",
-                        "fields": [True],
-                    },
-                    "customerGuid": {"case": "None"},
-                    "deliveryAreaId": {"case": "None"},
-                    "shouldShowCategoryBasedRecommendations": {"case": "None"},
-                }
-                yield JsonRequest(
-                    "https://catalog.chaldal.com/searchPersonalized",
-                    callback=self.parse_listings,
-                    data=data,
-                    cb_kwargs={
-                        "warehouse": area["WarehouseId"],
-                        "metropolitan": area["MetropolitanAreaId"],
-                    },
-                )
+            yield self.listing_request(
+                category["Id"],
+                areas[0]["WarehouseId"],
+                areas[0]["MetropolitanAreaId"],
+                page=0,
+                page_size=page_size,
+                other_areas=areas[1:],
+            )
 
-    def parse_listings(self, response: Response, warehouse: str, metropolitan: str):
-        payload = response.json()  # type: ignore
-        if payload["page"] < payload["nbPages"] and response.request is not None:
-            request_payload = json.loads(response.request.body.decode())
-            request_payload["currentPageIndex"] += 1
-
-            yield JsonRequest(
-                "https://catalog.chaldal.com/searchPersonalized",
-                callback=self.parse_listings,
-                data=request_payload,
-                cb_kwargs={
-                    "warehouse": warehouse,
-                    "metropolitan": metropolitan,
-                },
+    def listing_request(
+        self,
+        category: int,
+        warehouse: int,
+        metropolitan: int,
+        page: int,
+        page_size: int,
+        pages: int = 1,
+        other_areas: list[dict] | None = None,
+    ) -> JsonRequest:
+        data = {
+            "apiKey": self.api_key,
+            "storeId": 1,
+            "warehouseId": warehouse,
+            "pageSize": page_size,
+            "currentPageIndex": page,
+            "metropolitanAreaId": metropolitan,
+            "query": "",
+            "productVariantId": -1,
+            "bundleId": {"case": "None"},
+            "canSeeOutOfStock": "true",
+            "maxOutOfStockCount": {"case": "Some", "fields": [250]},
+            "filters": ["categories%3D" + str(category)],
+            "shouldShowAlternateProductsForAllOutOfStock": {
+                "case": "Some",
+                "fields": [True],
+            },
+            "customerGuid": {"case": "None"},
+            "deliveryAreaId": {"case": "None"},
+            "shouldShowCategoryBasedRecommendations": {"case": "None"},
+        }
+        return JsonRequest(
+            "https://catalog.chaldal.com/searchPersonalized",
+            callback=self.parse_listings,
+            errback=self.listing_failed,
+            data=data,
+            cb_kwargs={
+                "warehouse": warehouse,
+                "metropolitan": metropolitan,
+                "category": category,
+                "page_size": page_size,
+                "pages": pages,
+                "other_areas": other_areas,
+            },
+        )
+
+    def listing_failed(self, failure):
+        request = failure.request
+        if failure.check(HttpError) and failure.value.response.status in (401, 403):
+            yield from self.api_key_rejected(request)
+        elif request.cb_kwargs["other_areas"]:
+            yield from self.probe_failed(failure)
+
+    def api_key_rejected(self, request: JsonRequest):
+        """
+        The API key may have been rotated since the bootstrap was saved. The
+        saved bootstrap is dropped and the homepage fetched again, once per
+        run, and the rejected requests are retried with the new key.
+        """
+        if json.loads(request.body)["apiKey"] != self.api_key:
+            yield self.with_api_key(request)
+            return
+        if self.rejected is not None:
+            self.rejected.append(request)
+            return
+        if self.api_key_refreshed:
+            self.logger.error("listing request rejected after fetching a new API key: %s", request)
+            return
+
+        self.logger.warning("API key rejected, fetching the homepage again")
+        filename = self.settings.get("CHALDAL_BOOTSTRAP_FILE")
+        if filename and os.path.exists(filename):
+            os.remove(filename)
+        self.rejected = [request]
+        self.api_key_refreshed = True
+        yield scrapy.Request(
+            self.start_urls[0],
+            callback=self.parse_new_api_key,
+            errback=self.api_key_refresh_failed,
+            dont_filter=True,
+        )
+
+    def parse_new_api_key(self, response: Response):
+        try:
+            bootstrap = parse_bootstrap(response.text)
+        except ValueError as e:
+            self.drop_rejected(e)
+            return
+        self.save_bootstrap(bootstrap)
+        self.api_key = bootstrap.api_key
+        rejected, self.rejected = self.rejected or [], None
+        for request in rejected:
+            yield self.with_api_key(request)
+
+    def api_key_refresh_failed(self, failure):
+        self.drop_rejected(failure.value)
+
+    def drop_rejected(self, reason):
+        # Without a new key the waiting requests can't be retried. Later
+        # rejections are then logged one by one.
+        rejected, self.rejected = self.rejected or [], None
+        self.logger.error(
+            "fetching a new API key failed, dropping %s rejected listing requests: %s",
+            len(rejected),
+            reason,
+        )
+        for request in rejected:
+            self.logger.error("dropped listing request %s %s", request, request.cb_kwargs)
+
+    def with_api_key(self, request: JsonRequest) -> JsonRequest:
+        data = json.loads(request.body) | {"apiKey": self.api_key}
+        return request.replace(data=data, dont_filter=True)
+
+    def probe_failed(self, failure):
+        # The other warehouses are only requested from the probe's response.
+        # Without it they are paged like before, from the first page on.
+        kwargs = failure.request.cb_kwargs
+        self.crawler.stats.inc_value("chaldal/failed_probes")
+        self.logger.warning(
+            "probing category %s failed, crawling its other warehouses unplanned: %s",
+            kwargs["category"],
+            failure.value,
+        )
+        page_size = self.settings.getint("CHALDAL_PAGE_SIZE")
+        for area in kwargs["other_areas"]:
+            yield self.listing_request(
+                kwargs["category"],
+                area["WarehouseId"],
+                area["MetropolitanAreaId"],
+                page=0,
+                page_size=page_size,
             )
 
+    def parse_listings(
+        self,
+        response: Response,
+        warehouse: int,
+        metropolitan: int,
+        category: int,
+        page_size: int,
+        pages: int = 1,
+        other_areas: list[dict] | None = None,
+    ):
+        payload = response.json()  # type: ignore
+        if payload["page"] == 0:
+            # Pages this warehouse has beyond the ones already requested are
+            # all requested at once rather than one after another.
+            for page in range(pages, payload["nbPages"]):
+                yield self.listing_request(
+                    category, warehouse, metropolitan, page, page_size
+                )
+
+        if other_areas:
+            hits = payload.get("nbHits", payload["nbPages"] * page_size)
+            pages, size = plan_pages(hits, self.settings.getint("CHALDAL_PAGE_SIZE"))
+            for area in other_areas:
+                for page in range(pages):
+                    yield self.listing_request(
+                        category,
+                        area["WarehouseId"],
+                        area["MetropolitanAreaId"],
+                        page,
+                        size,
+                        pages,
+                    )
+
+        now = datetime.now()
         for hit in payload["hits"]:
             yield preprocess_item(
                 hit | {"warehouse": warehouse, "metropolitan": metropolitan},
                 ItemKind.Chaldal_LISTING,
+                now,
             )
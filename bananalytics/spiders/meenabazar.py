@@ -1,6 +1,7 @@
 import json
+import os
+from datetime import datetime
 from string import ascii_lowercase
-from urllib.parse import urljoin
 
 import scrapy
 from scrapy.http.request.json_request import JsonRequest
@@ -19,96 +20,197 @@ class MeenabazarSpider(scrapy.Spider):
         super().__init__(name, **kwargs)
 
         self.subunits: set[int] = set()
-        self.delivery_area_query_queue: set[str] = set(
-            [a + b for a in ascii_lowercase for b in ascii_lowercase]
-        )
+        # Branches the area searches of this run returned, and whether all of
+        # the searches went through in full, so the saved ones can be pruned.
+        self.discovered: set[int] = set()
+        self.discovery_failed = False
+        self.discovery_truncated = False
+        # Most areas a single search returned so far.
+        self.most_areas = 0
+        self.categories: list[dict] | None = None
 
     def start_requests(self):
-        for i in list(self.delivery_area_query_queue):
-            yield JsonRequest(
-                "https://meenabazardev.com/api/front/areas/search",
-                callback=self.parse_delivery_area,
-                data={"q": i},
-                cb_kwargs={"letter": i},
-            )
+        # Branches found by earlier runs are crawled right away. Discovery
+        # keeps running alongside and adds whatever is new.
+        for subunit_id in self.load_known_subunits():
+            yield from self.add_subunit(subunit_id)
+
+        yield scrapy.Request(
+            "https://meenabazardev.com/api/front/nav/categories/list",
+            callback=self.parse_categories,
+        )
+
+        for letter in ascii_lowercase:
+            yield self.area_search_request(letter)
+
+    def load_known_subunits(self) -> list[int]:
+        filename = self.settings.get("MEENABAZAR_SUBUNITS_FILE")
+        if not filename or not os.path.exists(filename):
+            return []
+        with open(filename) as f:
+            return json.load(f)
+
+    def closed(self, reason: str):
+        filename = self.settings.get("MEENABAZAR_SUBUNITS_FILE")
+        if not filename:
+            return
+        # Branches no search returns anymore are dropped, unless this run's
+        # discovery was cut short and may just have missed them.
+        complete = (
+            reason == "finished" and not self.discovery_failed and not self.discovery_truncated
+        )
+        subunits = self.discovered if complete else self.subunits
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(sorted(subunits), f)
+
+    def area_search_request(self, prefix: str) -> JsonRequest:
+        return JsonRequest(
+            "https://meenabazardev.com/api/front/areas/search",
+            callback=self.parse_delivery_area,
+            errback=self.area_search_failed,
+            data={"q": prefix},
+            cb_kwargs={"letter": prefix},
+        )
+
+    def area_search_failed(self, failure):
+        self.discovery_failed = True
+        self.logger.warning("area search failed: %s", failure.value)
+
+    def add_subunit(self, subunit_id: int):
+        if subunit_id in self.subunits:
+            return
+        self.subunits.add(subunit_id)
+        yield scrapy.Request(
+            f"https://meenabazardev.com/api/front/store/picup/name?SubUnitId={subunit_id}",
+            self.parse_subunit_name,
+        )
+        # A branch found after the categories came in still gets crawled.
+        for category in self.categories or []:
+            yield self.listing_request(category, subunit_id)
 
     def parse_delivery_area(self, response: Response, letter: str):
-        area = response.json()["data"]  # type: ignore
-        for item in area:
+        areas = response.json()["data"]  # type: ignore
+        for item in areas:
             # NOTE: They refer branches as "Subunits".
             # Not all branches are available online.
-            subunit_id = item["SubUnitId"]
-            if subunit_id not in self.subunits:
-                self.subunits.add(subunit_id)
-                yield response.follow(
-                    f"/api/front/store/picup/name?SubUnitId={subunit_id}",
-                    self.parse_subunit_name,
-                )
-        for area in area:
-            yield preprocess_item(area, ItemKind.Meenabazar_DELIVERY_AREA)
-
-        self.delivery_area_query_queue.remove(letter)
-        if not self.delivery_area_query_queue:
-            # Start parsing the categories AFTER we have
-            # fetched all the subunits or branch outlets.
-            yield scrapy.Request(
-                "https://meenabazardev.com/api/front/nav/categories/list",
-                callback=self.parse_categories,
+            self.discovered.add(item["SubUnitId"])
+            yield from self.add_subunit(item["SubUnitId"])
+        now = datetime.now()
+        for area in areas:
+            yield preprocess_item(area, ItemKind.Meenabazar_DELIVERY_AREA, now)
+
+        # A prefix without results is pruned. One with as many results as the
+        # search returns at most was probably cut short, so it is narrowed
+        # down by one more letter.
+        self.most_areas = max(self.most_areas, len(areas))
+        limit = self.settings.getint("MEENABAZAR_AREA_SEARCH_LIMIT") or self.most_areas
+        if not areas or len(areas) < limit:
+            return
+        if len(letter) < self.settings.getint("MEENABAZAR_AREA_PREFIX_MAX_LENGTH"):
+            for c in ascii_lowercase:
+                yield self.area_search_request(letter + c)
+        else:
+            self.discovery_truncated = True
+            if self.crawler.stats is not None:
+                self.crawler.stats.inc_value("meenabazar/truncated_area_searches")
+            self.logger.warning(
+                "area search %r returned %s results and may be cut short", letter, len(areas)
             )
 
+    def listing_request(self, category: dict, subunit: int) -> JsonRequest:
+        category_slug = category["CategorySlug"]
+        return JsonRequest(
+            f"https://meenabazardev.com/api/front/product/category/{category_slug}",
+            callback=self.parse_listing,
+            data={
+                "BrandId": [],
+                "CategoryId": [category["ItemCategoryId"]],
+                "NoOfItem": 20,
+                "SearchSlug": category_slug,
+                "SearchType": "C",
+                "StartSl": 1,
+                "SubCategoryId": [],
+                "SubUnitId": subunit,
+                "ThumbSize": "lg",
+            },
+            cb_kwargs={"subunit": subunit},
+        )
+
     def parse_categories(self, response: Response):
         categories = response.json()["data"]  # type: ignore
+        self.categories = categories
         for item in categories:
-            category_id = item["ItemCategoryId"]
-            category_slug = item["CategorySlug"]
-
             for subunit in self.subunits:
-                yield JsonRequest(
-                    urljoin(
-                        response.url,
-                        f"/api/front/product/category/{category_slug}",
-                    ),
-                    callback=self.parse_listing,
-                    data={
-                        "BrandId": [],
-                        "CategoryId": [category_id],
-                        "NoOfItem": 20,
-                        "SearchSlug": category_slug,
-                        "SearchType": "C",
-                        "StartSl": 1,
-                        "SubCategoryId": [],
-                        "SubUnitId": subunit,
-                        "ThumbSize": "lg",
-                    },
-                    cb_kwargs={"subunit": subunit},
-                )
+                yield self.listing_request(item, subunit)
         yield preprocess_item(categories, ItemKind.Meenabazar_CATEGORIES)
 
-    def parse_listing(self, response: Response, subunit: str):
+    def parse_listing(self, response: Response, subunit: int):
         data = json.loads(response.request.body)  # type: ignore
         items = response.json()["data"]["Category"]  # type: ignore
         if not items:
             return
 
+        now = datetime.now()
         for item in items:
             yield preprocess_item(
-                item | {"subunit": subunit}, ItemKind.Meenabazar_LISTING
+                item | {"subunit": subunit}, ItemKind.Meenabazar_LISTING, now
             )
 
-        old_start_sl = data["StartSl"]
-        data["StartSl"] += data["NoOfItem"]
         if len(items) < data["NoOfItem"]:
             return
 
-        if old_start_sl == 1:
-            data["NoOfItem"] = items[0]["TotalItem"] - data["NoOfItem"]
-
-        yield JsonRequest(
-            response.url,
-            callback=self.parse_listing,
-            data=data,
-            cb_kwargs={"subunit": subunit},
+        # The first page tells how big the category is, so the rest of it is
+        # requested at once in windows of bounded size. A failed window is
+        # then retried on its own.
+        # At least one item per window, or the windows would never get past
+        # the end of the category.
+        page_size = max(1, self.settings.getint("MEENABAZAR_PAGE_SIZE"))
+        total = items[0]["TotalItem"]
+        start_sl = data["StartSl"] + data["NoOfItem"]
+        while start_sl <= total:
+            last = start_sl + page_size > total
+            yield self.window_request(
+                response.url, data, subunit, start_sl, page_size, last
+            )
+            start_sl += page_size
+
+    def window_request(
+        self,
+        url: str,
+        data: dict,
+        subunit: int,
+        start_sl: int,
+        page_size: int,
+        last: bool,
+    ) -> JsonRequest:
+        return JsonRequest(
+            url,
+            callback=self.parse_listing_window,
+            data=data | {"StartSl": start_sl, "NoOfItem": page_size},
+            cb_kwargs={"subunit": subunit, "last": last},
         )
 
+    def parse_listing_window(self, response: Response, subunit: int, last: bool):
+        data = json.loads(response.request.body)  # type: ignore
+        items = response.json()["data"]["Category"]  # type: ignore
+
+        now = datetime.now()
+        for item in items:
+            yield preprocess_item(
+                item | {"subunit": subunit}, ItemKind.Meenabazar_LISTING, now
+            )
+
+        # The category grew past the TotalItem of its first page.
+        if last and len(items) == data["NoOfItem"]:
+            yield self.window_request(
+                response.url,
+                data,
+                subunit,
+                data["StartSl"] + data["NoOfItem"],
+                data["NoOfItem"],
+                True,
+            )
+
     def parse_subunit_name(self, response: Response):
         yield preprocess_item(response.json()["data"], ItemKind.Meenabazar_BRANCH)  # type: ignore
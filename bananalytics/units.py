@@ -0,0 +1,94 @@
+import re
+from collections.abc import Iterable
+from functools import cache
+from typing import NamedTuple
+
+# Leading number, then whatever is left is the unit. Same split as
+# extractors.get_quantity_and_unit, which only ever looked at digits and dots.
+QUANTITY_PATTERN = re.compile(r"([\d.]*)(.*)", re.DOTALL)
+
+# Spellings seen in the vendors' listings, mapped to the canonical unit, the
+# unit prices are compared in and how many of those one canonical unit is.
+CANONICAL_UNITS: dict[str, tuple[str, str, float]] = {
+    "g": ("g", "kg", 0.001),
+    "gm": ("g", "kg", 0.001),
+    "gms": ("g", "kg", 0.001),
+    "gram": ("g", "kg", 0.001),
+    "grams": ("g", "kg", 0.001),
+    "gr": ("g", "kg", 0.001),
+    "kg": ("kg", "kg", 1),
+    "kgs": ("kg", "kg", 1),
+    "kilo": ("kg", "kg", 1),
+    "kilogram": ("kg", "kg", 1),
+    "ml": ("ml", "l", 0.001),
+    "l": ("l", "l", 1),
+    "lt": ("l", "l", 1),
+    "ltr": ("l", "l", 1),
+    "litre": ("l", "l", 1),
+    "liter": ("l", "l", 1),
+    "each": ("pcs", "pcs", 1),
+    "pc": ("pcs", "pcs", 1),
+    "pcs": ("pcs", "pcs", 1),
+    "piece": ("pcs", "pcs", 1),
+    "pieces": ("pcs", "pcs", 1),
+    "dozen": ("dozen", "pcs", 12),
+}
+
+
+class Quantity(NamedTuple):
+    quantity: float
+    unit: str
+    # None when the unit is not one of CANONICAL_UNITS.
+    base_quantity: float | None
+    base_unit: str | None
+
+
+def split_quantity(text: str) -> tuple[float, str]:
+    """
+    >>> split_quantity("1.1kg")
+    (1.1, 'kg')
+    >>> split_quantity("500 Gram ±")
+    (500.0, 'gram')
+    >>> split_quantity("Each")
+    (1.0, 'each')
+    """
+    match = QUANTITY_PATTERN.match(text)
+    assert match is not None
+    qty, unit = match.groups()
+    return (float(qty or 1), unit.replace("±", "").strip().lower())
+
+
+@cache
+def parse_quantity(text: str) -> Quantity:
+    """
+    Parse and normalize a listing's unit text. Listings only use a few dozen
+    distinct texts, so results are cached for the life of the process.
+
+    >>> parse_quantity("250 Gm")
+    Quantity(quantity=250.0, unit='g', base_quantity=0.25, base_unit='kg')
+    >>> parse_quantity("1.5 ltr")
+    Quantity(quantity=1.5, unit='l', base_quantity=1.5, base_unit='l')
+    >>> parse_quantity("Each")
+    Quantity(quantity=1.0, unit='pcs', base_quantity=1.0, base_unit='pcs')
+    >>> parse_quantity("2 bundle")
+    Quantity(quantity=2.0, unit='bundle', base_quantity=None, base_unit=None)
+    """
+    qty, unit = split_quantity(text)
+    canonical = CANONICAL_UNITS.get(unit)
+    if canonical is None:
+        return Quantity(qty, unit, None, None)
+
+    unit, base_unit, factor = canonical
+    # Rounded, so 250 * 0.001 comes out as 0.25 and not 0.25000000000000006.
+    return Quantity(qty, unit, round(qty * factor, 9), base_unit)
+
+
+def parse_quantities(texts: Iterable[str]) -> list[Quantity]:
+    """
+    Parse a whole column of unit texts. Repeated texts are cache hits, so
+    each distinct text is only parsed once.
+
+    >>> [q.base_quantity for q in parse_quantities(["1 kg", "500 gm", "1 kg"])]
+    [1.0, 0.5, 1.0]
+    """
+    return list(map(parse_quantity, texts))
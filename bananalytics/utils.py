@@ -1,9 +1,11 @@
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Any
-from urllib.parse import urlencode
+from urllib.parse import quote_plus
 
 from pydantic import BaseModel
 
+from bananalytics import metrics
 from bananalytics.kinds import ItemKind
 
 
@@ -16,52 +18,80 @@ class BananlyticsModel(BaseModel):
     unique_key: str | None
 
 
+# What the spiders yield. Same fields, in the same order, as BananlyticsModel,
+# so runs serialize to the same jsonlines, but without validating every item.
+# etl.py still reads runs back with BananlyticsModel.
+@dataclass(slots=True)
+class BananlyticsItem:
+    payload: Any
+    date: datetime
+    kind: ItemKind
+    unique_key: str | None
+
+
+# The payload fields identifying an item, per kind of item that is deduplicated.
+UNIQUE_KEY_FIELDS: dict[ItemKind, tuple[str, ...]] = {
+    ItemKind.Meenabazar_DELIVERY_AREA: ("AreaId",),
+    ItemKind.Meenabazar_LISTING: ("subunit", "ItemId"),
+    ItemKind.Meenabazar_BRANCH: ("SubUnitId",),
+    ItemKind.Chaldal_LISTING: ("warehouse", "objectID"),
+}
+
+
+def unique_key(item: dict, fields: tuple[str, ...]) -> str:
+    """
+    The query string urlencode made of the fields, which is what keys have
+    always looked like. Ids are mostly ints, which need no quoting.
+
+    >>> unique_key({"warehouse": 8, "objectID": 10000}, ("warehouse", "objectID"))
+    'warehouse=8&objectID=10000'
+    >>> unique_key({"subunit": "x y", "ItemId": "a&b"}, ("subunit", "ItemId"))
+    'subunit=x+y&ItemId=a%26b'
+    """
+    parts = []
+    for field in fields:
+        value = item[field]
+        if type(value) is not int:
+            value = quote_plus(str(value))
+        parts.append(f"{field}={value}")
+    return "&".join(parts)
+
+
 def overwrite_fields(
     item: dict,
     kind: ItemKind,
 ) -> dict:
     if kind == ItemKind.Chaldal_LISTING:
-        elts = []
         for elt in item["productAvailabilityForSelectedWarehouse"]:
-            d = {}
-            for k, v in elt.items():
+            for v in elt.values():
                 if isinstance(v, dict):
                     v["UnixTimeMilliseconds"] = 0
-                d[k] = v
-            elts.append(d)
-        item["productAvailabilityForSelectedWarehouse"] = elts
     return item
 
 
+# Kinds are named after the spider yielding them, e.g. chaldal_listing.
+SPIDER_OF_KIND = {kind: kind.split("_", 1)[0] for kind in ItemKind}
+
+
 def preprocess_item(
-    item: dict,
+    item: Any,
     kind: ItemKind,
-) -> BananlyticsModel:
+    date: datetime | None = None,
+) -> BananlyticsItem:
+    """
+    Wrap a scraped object as an item. Callbacks yielding many items from one
+    response should pass the response's `date`, rather than have every item
+    look up the time.
+    """
+    metrics.inc("items_total", spider=SPIDER_OF_KIND[kind], kind=kind)
     unique = None
     if not should_skip_deduplication(kind):
-        match kind:
-
-            case ItemKind.Meenabazar_DELIVERY_AREA:
-                keys = ["AreaId"]
-            case ItemKind.Meenabazar_LISTING:
-                keys = ["subunit", "ItemId"]
-            case ItemKind.Meenabazar_BRANCH:
-                keys = ["SubUnitId"]
+        fields = UNIQUE_KEY_FIELDS.get(kind)
+        if fields is None:
+            raise TypeError("this kind of item is not handled", kind)
+        unique = unique_key(item, fields)
 
-            case ItemKind.Chaldal_LISTING:
-                keys = ["warehouse", "objectID"]
-
-            case _ as kind:
-                raise TypeError("this kind of item is not handled", kind)
-
-        unique = urlencode({key: item[key] for key in keys})
-
-    return BananlyticsModel(
-        unique_key=unique,
-        date=datetime.now(),
-        kind=kind,
-        payload=item,
-    )
+    return BananlyticsItem(item, date or datetime.now(), kind, unique)
 
 
 def should_skip_deduplication(kind: ItemKind) -> bool:
@@ -0,0 +1,52 @@
+"""
+Compare the lines/sec of `etl.load` (a BananlyticsModel and a Row per line)
+and `etl.load_fast` (validation against narrow per-kind TypedDicts, straight
+to tuples) on a synthetic Chaldal run. Both extract the listings and parse
+their quantities the same way.
+
+    python -m benchmarks.decode --lines 1000000
+"""
+
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import etl
+from benchmarks.fixtures import chaldal_lines, write_lines
+
+parser = ArgumentParser(epilog="Benchmark the etl.py decoders.")
+parser.add_argument("--lines", type=int, default=1_000_000)
+parser.add_argument(
+    "--file",
+    help="Use this fixture file, generating it first if it does not exist.",
+)
+
+
+def decoders():
+    return {
+        "model": lambda f, metadata: (row.values() for row in etl.load(f, metadata)),
+        "fast": etl.load_fast,
+    }
+
+
+if __name__ == "__main__":
+    namespace = parser.parse_args()
+    filename = namespace.file or os.path.join(
+        tempfile.gettempdir(), f"chaldal_bench_{namespace.lines}.jsonlines"
+    )
+    if not os.path.exists(filename):
+        write_lines(filename, chaldal_lines(namespace.lines))
+
+    with open(filename, encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+
+    for name, decode in decoders().items():
+        with open(filename, encoding="utf-8") as f:
+            started = time.perf_counter()
+            rows = sum(1 for _ in decode(f, {}))
+            elapsed = time.perf_counter() - started
+        print(
+            f"{name:>6}: {rows} rows from {lines} lines in {elapsed:.2f}s"
+            f" ({lines / elapsed:,.0f} lines/s)"
+        )
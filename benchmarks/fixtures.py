@@ -0,0 +1,174 @@
+"""
+Synthetic crawl output shaped like what the spiders emit, for benchmarking
+without hitting the vendors.
+"""
+
+import json
+import random
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+
+from bananalytics.kinds import ItemKind
+
+WORDS = (
+    "fresh rice dal atta oil sugar salt tea coffee milk egg chicken beef fish"
+    " onion potato garlic ginger soap shampoo biscuit noodles juice water"
+).split()
+UNITS = ("1 kg", "500 gm", "250 Gm", "1000g", "1.5 ltr", "Each", "12 pcs", "400 Gram ±")
+
+FEED_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def name(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 5)))
+
+
+def chaldal_hit(rng: random.Random, object_id: int, warehouse: int) -> dict:
+    mrp = rng.randint(20, 2000)
+    base = name(rng)
+    sub_text = rng.choice(UNITS)
+    return {
+        "objectID": object_id,
+        "productVariantId": object_id,
+        "corpusId": rng.randint(1, 10**6),
+        "name": f"{base} {sub_text}",
+        "nameWithoutSubText": base,
+        "subText": sub_text,
+        "slug": base.lower().replace(" ", "-"),
+        "mrp": mrp,
+        "price": mrp if rng.random() < 0.7 else mrp - rng.randint(1, mrp // 4 + 1),
+        "picturesUrls": [
+            f"https://chaldn.com/_mpimage/{base.lower().replace(' ', '-')}?q=low&v=1&m=400&webp=1"
+            for _ in range(rng.randint(1, 3))
+        ],
+        "categories": [rng.randint(1, 1500) for _ in range(rng.randint(1, 4))],
+        "tagIds": [rng.randint(1, 500) for _ in range(rng.randint(0, 6))],
+        "recipeIds": [],
+        "historySeqNumber": rng.randint(1, 10**6),
+        "productAvailabilityForSelectedWarehouse": [
+            {
+                "ProductVariantId": object_id,
+                "WarehouseId": warehouse,
+                "Quantity": rng.randint(0, 200),
+                "LastUpdated": {"UnixTimeMilliseconds": rng.randint(0, 2**41)},
+            }
+        ]
+        if rng.random() < 0.9
+        else [],
+        "warehouse": warehouse,
+        "metropolitan": 1,
+    }
+
+
+def chaldal_search_response(
+    rng: random.Random, warehouse: int, page: int, page_size: int, nb_hits: int
+) -> dict:
+    """A searchPersonalized response body."""
+    start = page * page_size
+    return {
+        "hits": [
+            chaldal_hit(rng, 10000 + i, warehouse)
+            for i in range(start, min(start + page_size, nb_hits))
+        ],
+        "nbHits": nb_hits,
+        "page": page,
+        "nbPages": -(-nb_hits // page_size),
+        "hitsPerPage": page_size,
+    }
+
+
+def meenabazar_item(rng: random.Random, item_id: int, total: int) -> dict:
+    price = rng.randint(20, 2000)
+    return {
+        "ItemId": item_id,
+        "ItemDisplayName": name(rng),
+        "ItemSlug": f"item-{item_id}",
+        "Unit": rng.choice(UNITS),
+        "UnitSalesPrice": price,
+        "DiscountSalesPrice": price - rng.randint(0, price // 5),
+        "StockQuantity": rng.randint(0, 100),
+        "ImageUrl": f"/images/product/{item_id}.jpg",
+        "BrandName": rng.choice(WORDS).title(),
+        "TotalItem": total,
+    }
+
+
+def meenabazar_category_page(
+    rng: random.Random, start_sl: int, count: int, total: int
+) -> dict:
+    """A /api/front/product/category/<slug> response body."""
+    return {
+        "data": {
+            "Category": [
+                meenabazar_item(rng, item_id, total)
+                for item_id in range(start_sl, min(start_sl + count, total + 1))
+            ]
+        }
+    }
+
+
+def feed_line(payload, kind: ItemKind, unique_key: str | None, date: datetime) -> str:
+    """Serialize an item the way the jsonlines feed exporter does."""
+    return json.dumps(
+        {
+            "payload": payload,
+            "date": date.strftime(FEED_DATE_FORMAT),
+            "kind": kind,
+            "unique_key": unique_key,
+        },
+        ensure_ascii=False,
+    )
+
+
+def chaldal_lines(count: int, warehouses: int = 8, seed: int = 0) -> Iterator[str]:
+    """
+    Lines of a Chaldal run: the bootstrap metadata followed by `count` listings
+    spread over `warehouses`.
+    """
+    rng = random.Random(seed)
+    date = datetime(2025, 4, 1, 12)
+    yield feed_line([{"Id": 1, "ContainsProducts": True}], ItemKind.Chaldal_CATEGORIES, None, date)
+    yield feed_line({"Areas": {}}, ItemKind.Chaldal_SHOP_METADATA, None, date)
+    for i in range(count):
+        warehouse = 1 + i % warehouses
+        object_id = 10000 + i // warehouses
+        if i % 250 == 0:
+            date += timedelta(seconds=1)
+        yield feed_line(
+            chaldal_hit(rng, object_id, warehouse),
+            ItemKind.Chaldal_LISTING,
+            f"warehouse={warehouse}&objectID={object_id}",
+            date,
+        )
+
+
+def meenabazar_lines(count: int, subunits: int = 20, seed: int = 0) -> Iterator[str]:
+    """Lines of a Meenabazar run with `count` listings spread over `subunits`."""
+    rng = random.Random(seed)
+    date = datetime(2025, 4, 1, 12)
+    for subunit in range(1, subunits + 1):
+        yield feed_line(
+            {"SubUnitId": subunit, "Name": name(rng)},
+            ItemKind.Meenabazar_BRANCH,
+            f"SubUnitId={subunit}",
+            date,
+        )
+    for i in range(count):
+        subunit = 1 + i % subunits
+        item_id = 1 + i // subunits
+        if i % 100 == 0:
+            date += timedelta(seconds=1)
+        yield feed_line(
+            meenabazar_item(rng, item_id, count // subunits) | {"subunit": subunit},
+            ItemKind.Meenabazar_LISTING,
+            f"subunit={subunit}&ItemId={item_id}",
+            date,
+        )
+
+
+def write_lines(filename: str, lines: Iterator[str]) -> str:
+    with open(filename, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+    return filename
@@ -1,16 +1,31 @@
+import gzip
+import json
 import logging
 import os
+import sys
 from argparse import ArgumentParser
-from collections import defaultdict
-from datetime import datetime
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import batched, islice
 from os import path
-from typing import TextIO
+from typing import Annotated, Any, Literal, TextIO, TypedDict
 
 import psycopg
+from psycopg import sql
 from psycopg.errors import UniqueViolation
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 
+from bananalytics import metrics
+from bananalytics.extractors import (
+    LISTING_EXTRACTORS,
+    ChaldalListingPayload,
+    Listing,
+    MeenabazarListingPayload,
+)
 from bananalytics.kinds import ItemKind
+from bananalytics.profiling import ProfileSession, run_prefix
 from bananalytics.utils import BananlyticsModel
 
 parser = ArgumentParser(
@@ -19,44 +34,129 @@ parser = ArgumentParser(
 
 parser.add_argument(
     "files",
-    nargs="+",
-    help="Load these files. Must containing jsonline serialized bananalytics objects.",
-)
-
-parser.add_argument("--dsn", help="database connection string")
-
-
-def get_quantity_and_unit(text: str) -> tuple[float, str]:
-    """
-    >>> get_quantity_and_unit("KG")
-    (1.0, 'kg')
-    >>> get_quantity_and_unit("1000g")
-    (1000.0, 'g')
-    >>> get_quantity_and_unit("1.1kg")
-    (1.1, 'kg')
-    >>> get_quantity_and_unit("250")
-    (250.0, '')
-    >>> get_quantity_and_unit("250 Gm")
-    (250.0, 'gm')
-    >>> get_quantity_and_unit("500 Gram ±")
-    (500.0, 'gram')
-    >>> get_quantity_and_unit("Each")
-    (1.0, 'each')
-    """
-    s = 0
-    for c in text:
-        if c.isdigit() or c == ".":
-            s += 1
-        else:
-            break
+    nargs="*",
+    help="Load these files. Must containing jsonline serialized bananalytics objects, optionally gzip (.gz) or zstd (.zst) compressed, or be written by the parquet feed exporter (.parquet).",
+)
+
+parser.add_argument(
+    "--dsn",
+    default="",
+    help="database connection string, libpq's PG* environment variables are used when left out",
+)
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=5000,
+    help="Insert parsed rows into the database in batches of this many rows.",
+)
+parser.add_argument(
+    "--engine",
+    choices=("insert", "copy"),
+    default="insert",
+    help="How rows are written to the database: batched INSERTs or a binary COPY stream.",
+)
+parser.add_argument(
+    "--decoder",
+    choices=("model", "fast"),
+    default="model",
+    help="Validate every line with the full Pydantic models, or only decode the fields that get stored.",
+)
+parser.add_argument(
+    "--jobs",
+    "-j",
+    type=int,
+    default=1,
+    help="Load this many files in parallel, each worker process with its own connection.",
+)
+parser.add_argument(
+    "--store",
+    choices=("datapoints", "changes"),
+    default="datapoints",
+    help="Store every row of a run in datapoints, or only the listings whose price or stock changed since the last run in price_changes.",
+)
+parser.add_argument(
+    "--checkpoint-every",
+    type=int,
+    default=50_000,
+    help="Commit jsonlines files every this many rows, so an interrupted load resumes where it stopped. 0 loads every file in one transaction.",
+)
+parser.add_argument(
+    "--profile",
+    action="append",
+    default=[],
+    choices=(
+        "load",
+        "load_fast",
+        "load_parquet",
+        "insert_everything",
+        "insert_checkpointed",
+        "store_changes",
+        "update_serving_tables",
+    ),
+    help="Profile this stage with cProfile, can be given more than once. Profiles of every file are written next to it as <run>.<stage>.pstats and <run>.<stage>.collapsed. Only stages the load runs are written: jsonlines files go through insert_checkpointed unless --checkpoint-every is 0, and store_changes only runs with --store changes.",
+)
+parser.add_argument(
+    "--metrics",
+    help="Write rows loaded, load times and skipped items to this file as JSON.",
+)
+parser.add_argument(
+    "--retain-months",
+    type=int,
+    help="After loading, detach the datapoints partitions of months older than this many months before the current one.",
+)
+parser.add_argument(
+    "--archive-dir",
+    help="Export detached partitions to gzipped CSV files in this directory and drop them.",
+)
+
+
+def open_input(filename: str) -> TextIO:
+    """
+    Open a jsonlines file for reading, decompressing it on the fly if it is
+    gzip or zstd compressed.
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8")
+    if filename.endswith(".zst"):
+        try:
+            from compression import zstd  # type: ignore[import-not-found]
+        except ImportError:
+            # Python < 3.14
+            try:
+                from backports import zstd  # type: ignore[import-not-found, no-redef]
+            except ImportError as e:
+                raise RuntimeError(
+                    "reading .zst files requires Python 3.14 or the backports.zstd package"
+                ) from e
+        return zstd.open(filename, "rt", encoding="utf-8")
+    return open(filename, encoding="utf-8")
+
+
+# Row.values() and the fast loader both produce rows in this shape, which is
+# what the writers consume.
+# item_id, name, quantity, unit, stock, price, sale_price, base_quantity,
+# base_unit, unique_key, fetched_at
+RowValues = tuple[
+    str, str, float, str, int, float, float, float | None, str | None, str, datetime
+]
 
-    qty = text[:s]
-    unit = text[s:]
 
-    if "±" in unit:
-        unit = unit.replace("±", "")
+class LineCounter:
+    """
+    Iterate over the lines of a file from line `start` on, counting the lines
+    read so far. The loaders pull lines lazily, so once a row comes out of
+    them, `count` is the line it was read from.
+    """
 
-    return (float(1 if qty == "" else qty), unit.strip().lower())
+    def __init__(self, file: TextIO, start: int = 0):
+        self.file = file
+        self.start = start
+        self.count = start
+
+    def __iter__(self) -> Iterator[str]:
+        for line in islice(self.file, self.start, None):
+            self.count += 1
+            yield line
 
 
 class Row(BaseModel):
@@ -70,85 +170,212 @@ class Row(BaseModel):
     price: float
     sale_price: float
 
+    base_quantity: float | None
+    base_unit: str | None
+
     unique_key: str
     date: datetime
 
+    def values(self) -> RowValues:
+        return (
+            self.id,
+            self.name,
+            self.quantity,
+            self.unit,
+            self.stock,
+            self.price,
+            self.sale_price,
+            self.base_quantity,
+            self.base_unit,
+            self.unique_key,
+            self.date,
+        )
+
+
+def add_metadata(
+    metadata: dict,
+    kind: ItemKind,
+    d,
+    unique_key: str | None = None,
+    date: datetime | None = None,
+):
+    match kind:
+        case ItemKind.Chaldal_CATEGORIES:
+            metadata["categories"] = d
+        case ItemKind.Chaldal_BRANDS:
+            metadata["brands"] = d
+        case ItemKind.Chaldal_SHOP_METADATA:
+            metadata["shop_metadata"] = d
+        case ItemKind.Meenabazar_DELIVERY_AREA:
+            metadata.setdefault("deliver_areas", []).append(d)
+        case ItemKind.Meenabazar_CATEGORIES:
+            metadata["categories"] = d
+        case ItemKind.Meenabazar_BRANCH:
+            metadata.setdefault("branches", []).append(d)
+        case ItemKind.Chaldal_LISTING_UNCHANGED | ItemKind.Meenabazar_LISTING_UNCHANGED:
+            # Listings an incremental crawl saw but did not re-emit, with when
+            # it saw them.
+            metadata.setdefault("unchanged", {})[unique_key] = date
+
+        case _ as kind:
+            raise TypeError("Idk what kinda type this is", kind)
+
+
+def skip_zero_price(kind: str, item_id: str):
+    vendor = kind.split("_", 1)[0]
+    metrics.inc("etl_zero_price_skipped_total", vendor=vendor)
+    logging.warning("skipping item %s from vendor %s (price = 0).", item_id, vendor)
+
 
-def load(file: TextIO) -> tuple[dict, list[Row]]:
-    metadata = defaultdict(list)
-    rows: list[Row] = []
+def load(file: Iterable[str], metadata: dict) -> Iterator[Row]:
+    """
+    Lazily parse a jsonlines file, yielding one row per listing.
+
+    Non-listing items are collected into `metadata` as they are read, so it is
+    only complete once the generator is exhausted.
+    """
     for line in file:
         model = BananlyticsModel.model_validate_json(line)
-        d = model.payload
-
-        item_id = vendor = ""
-        row: Row | None = None
-        match model.kind:
-            case ItemKind.Chaldal_LISTING:
-                item_id = str(d["objectID"])
-                vendor = "chaldal"
-
-                sub_text = d["subText"]
-                qty, unit = get_quantity_and_unit(sub_text)
-
-                assert model.unique_key is not None
-                row = Row(
-                    id=item_id,
-                    name=d["nameWithoutSubText"],
-                    quantity=qty,
-                    unit=unit,
-                    stock=(
-                        0
-                        if len(d["productAvailabilityForSelectedWarehouse"]) == 0
-                        else d["productAvailabilityForSelectedWarehouse"][0]["Quantity"]
-                    ),
-                    price=d["mrp"],
-                    sale_price=d["price"],
-                    unique_key=model.unique_key,
-                    date=model.date,
-                )
-            case ItemKind.Chaldal_CATEGORIES:
-                metadata["categories"] = d
-            case ItemKind.Chaldal_BRANDS:
-                metadata["brands"] = d
-            case ItemKind.Chaldal_SHOP_METADATA:
-                metadata["shop_metadata"] = d
-            case ItemKind.Meenabazar_LISTING:
-                item_id = str(d["ItemId"])
-                vendor = "meenabazar"
-
-                qty, unit = get_quantity_and_unit(d["Unit"])
-
-                assert model.unique_key is not None
-                row = Row(
-                    id=item_id,
-                    name=d["ItemDisplayName"],
-                    quantity=qty,
-                    unit=unit,
-                    stock=d["StockQuantity"],
-                    price=d["UnitSalesPrice"],
-                    sale_price=d["DiscountSalesPrice"],
-                    unique_key=model.unique_key,
-                    date=model.date,
-                )
-            case ItemKind.Meenabazar_DELIVERY_AREA:
-                metadata["deliver_areas"].append(d)
-            case ItemKind.Meenabazar_CATEGORIES:
-                metadata["categories"] = d
-            case ItemKind.Meenabazar_BRANCH:
-                metadata["branches"].append(d)
-
-            case _ as kind:
-                raise TypeError("Idk what kinda type this is", kind)
-
-        if row is not None:
-            if row.price == 0:
-                logging.warning(
-                    "skipping item %s from vendor %s (price = 0).", item_id, vendor
-                )
-                continue
-            rows.append(row)
-    return metadata, rows
+        extract = LISTING_EXTRACTORS.get(model.kind)
+        if extract is None:
+            add_metadata(metadata, model.kind, model.payload, model.unique_key, model.date)
+            continue
+
+        item_id, name, qty, unit, stock, price, sale_price, base_qty, base_unit = (
+            extract(model.payload)
+        )
+        if price == 0:
+            skip_zero_price(model.kind, item_id)
+            continue
+
+        assert model.unique_key is not None
+        yield Row(
+            id=item_id,
+            name=name,
+            quantity=qty,
+            unit=unit,
+            stock=stock,
+            price=price,
+            sale_price=sale_price,
+            base_quantity=base_qty,
+            base_unit=base_unit,
+            unique_key=model.unique_key,
+            date=model.date,
+        )
+
+
+class ChaldalListingLine(TypedDict):
+    kind: Literal[ItemKind.Chaldal_LISTING]
+    payload: ChaldalListingPayload
+    date: str
+    unique_key: str
+
+
+class MeenabazarListingLine(TypedDict):
+    kind: Literal[ItemKind.Meenabazar_LISTING]
+    payload: MeenabazarListingPayload
+    date: str
+    unique_key: str
+
+
+class MetadataLine(TypedDict):
+    kind: Literal[
+        ItemKind.Chaldal_CATEGORIES,
+        ItemKind.Chaldal_BRANDS,
+        ItemKind.Chaldal_SHOP_METADATA,
+        ItemKind.Meenabazar_DELIVERY_AREA,
+        ItemKind.Meenabazar_CATEGORIES,
+        ItemKind.Meenabazar_BRANCH,
+        ItemKind.Chaldal_LISTING_UNCHANGED,
+        ItemKind.Meenabazar_LISTING_UNCHANGED,
+    ]
+    payload: Any
+    date: str
+    unique_key: str | None
+
+
+line_adapter: TypeAdapter[ChaldalListingLine | MeenabazarListingLine | MetadataLine] = (
+    TypeAdapter(
+        Annotated[
+            ChaldalListingLine | MeenabazarListingLine | MetadataLine,
+            Field(discriminator="kind"),
+        ]
+    )
+)
+
+
+def load_fast(file: Iterable[str], metadata: dict) -> Iterator[RowValues]:
+    """
+    Same as `load`, but without building a BananlyticsModel and a Row for every
+    line. Lines are parsed against narrow per-kind schemas, so only the fields
+    that are stored get decoded, and rows come out as plain tuples.
+    """
+    validate_json = line_adapter.validate_json
+    fromisoformat = datetime.fromisoformat
+    last_date = None
+    date = datetime.min
+    for line in file:
+        obj = validate_json(line)
+        kind = obj["kind"]
+        extract = LISTING_EXTRACTORS.get(kind)
+        if extract is None:
+            add_metadata(
+                metadata, kind, obj["payload"], obj["unique_key"], fromisoformat(obj["date"])
+            )
+            continue
+
+        values = extract(obj["payload"])
+        if values[5] == 0:
+            skip_zero_price(kind, values[0])
+            continue
+
+        # Items of one response share a timestamp, so it rarely changes
+        # between consecutive lines.
+        if obj["date"] != last_date:
+            last_date = obj["date"]
+            date = fromisoformat(last_date)
+        unique_key = obj["unique_key"]
+        assert unique_key is not None
+        yield (*values, unique_key, date)
+
+
+def load_parquet(filename: str, metadata: dict) -> Iterator[RowValues]:
+    """
+    Read a file written by bananalytics.parquet.ParquetItemExporter. Listing
+    columns are already normalized there, so rows are filtered and converted
+    a record batch at a time instead of a line at a time.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    from bananalytics.parquet import LISTING_COLUMNS, METADATA_KEY
+
+    file = pq.ParquetFile(filename)
+    footer = file.metadata.metadata or {}
+    for kind, payloads in json.loads(footer.get(METADATA_KEY.encode(), b"{}")).items():
+        for payload in payloads:
+            add_metadata(metadata, ItemKind(kind), payload)
+
+    columns = [name for name, _ in LISTING_COLUMNS] + ["unique_key", "fetched_at"]
+    for batch in file.iter_batches(columns=["kind", *columns]):
+        # Unchanged markers are the rows without listing values.
+        is_listing = pc.is_valid(batch["price"])
+        if pc.sum(is_listing).as_py() < batch.num_rows:
+            unchanged = batch.filter(pc.invert(is_listing))
+            metadata.setdefault("unchanged", {}).update(
+                zip(unchanged["unique_key"].to_pylist(), unchanged["fetched_at"].to_pylist())
+            )
+
+        is_zero = pc.and_(is_listing, pc.equal(batch["price"], 0))
+        if pc.any(is_zero).as_py():
+            skipped = batch.filter(is_zero)
+            for kind, item_id in zip(
+                skipped["kind"].to_pylist(), skipped["item_id"].to_pylist()
+            ):
+                skip_zero_price(kind, item_id)
+
+        rows = batch.filter(pc.and_(is_listing, pc.invert(is_zero)))
+        yield from zip(*(rows[name].to_pylist() for name in columns))
 
 
 class Run(BaseModel):
@@ -160,7 +387,8 @@ class Run(BaseModel):
 
     @classmethod
     def from_filename(cls, filename: str, metadata: dict) -> "Run":
-        value_str = path.splitext(path.basename(filename))[0]
+        # Strip every extension, e.g. ".jsonlines.gz".
+        value_str = path.basename(filename).split(".", 1)[0]
         vendor, started, ended, run_id = value_str.split("_")
         return cls(
             run_id=run_id,
@@ -171,44 +399,619 @@ class Run(BaseModel):
         )
 
 
-def insert_everything(conn: psycopg.Connection, run: Run, rows: list[Row]):
+DATAPOINT_COLUMNS = "item_id, name, quantity, unit, stock, price, sale_price, base_quantity, base_unit, unique_key, fetched_at, run_id"
+
+# Binary COPY does no casting, so every column has to be sent as the exact
+# type of the target column.
+DATAPOINT_TYPES = [
+    "varchar",
+    "varchar",
+    "numeric",
+    "varchar",
+    "int4",
+    "numeric",
+    "numeric",
+    "numeric",
+    "varchar",
+    "varchar",
+    "timestamp",
+    "int4",
+]
+
+
+def insert_rows(
+    cur: psycopg.Cursor, run_id: int, rows: Iterable[RowValues], batch_size: int
+) -> int:
+    count = 0
+    for batch in batched(rows, batch_size):
+        values = [(*r, run_id) for r in batch]
+        cur.executemany(
+            f"""insert into datapoints({DATAPOINT_COLUMNS})
+                values(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            values,
+        )
+        count += len(values)
+    return count
+
+
+def copy_rows(
+    cur: psycopg.Cursor, run_id: int, rows: Iterable[RowValues], batch_size: int
+) -> int:
+    # psycopg buffers and flushes the COPY stream on its own, so there is no
+    # need to batch here.
+    count = 0
+    with cur.copy(
+        f"copy datapoints({DATAPOINT_COLUMNS}) from stdin (format binary)"
+    ) as copy:
+        copy.set_types(DATAPOINT_TYPES)
+        for (
+            item_id,
+            name,
+            qty,
+            unit,
+            stock,
+            price,
+            sale_price,
+            base_qty,
+            base_unit,
+            key,
+            date,
+        ) in rows:
+            copy.write_row(
+                (
+                    item_id,
+                    name,
+                    Decimal(str(qty)),
+                    unit,
+                    stock,
+                    Decimal(str(price)),
+                    Decimal(str(sale_price)),
+                    None if base_qty is None else Decimal(str(base_qty)),
+                    base_unit,
+                    key,
+                    date,
+                    run_id,
+                )
+            )
+            count += 1
+    return count
+
+
+ENGINES = {
+    "insert": insert_rows,
+    "copy": copy_rows,
+}
+
+
+# Listings are only replaced by newer datapoints, so loading an old run after
+# a newer one leaves latest_prices alone.
+UPDATE_LATEST_PRICES = """
+insert into latest_prices (
+    vendor, unique_key, item_id, name, quantity, unit, base_quantity,
+    base_unit, stock, price, sale_price, discount, fetched_at, run_id
+)
+select distinct on (d.unique_key)
+    r.vendor, d.unique_key, d.item_id, d.name, d.quantity, d.unit,
+    d.base_quantity, d.base_unit, d.stock, d.price, d.sale_price, d.discount,
+    d.fetched_at, d.run_id
+from datapoints d
+join runs r on r.id = d.run_id
+where d.run_id = %(run_id)s
+order by d.unique_key, d.fetched_at desc
+on conflict (vendor, unique_key) do update set
+    item_id = excluded.item_id,
+    name = excluded.name,
+    quantity = excluded.quantity,
+    unit = excluded.unit,
+    base_quantity = excluded.base_quantity,
+    base_unit = excluded.base_unit,
+    stock = excluded.stock,
+    price = excluded.price,
+    sale_price = excluded.sale_price,
+    discount = excluded.discount,
+    fetched_at = excluded.fetched_at,
+    run_id = excluded.run_id
+where latest_prices.fetched_at <= excluded.fetched_at
+"""
+
+UPDATE_DAILY_PRICES = """
+insert into daily_prices (
+    vendor, item_id, day, min_price, max_price, sum_price, min_sale_price,
+    max_sale_price, sum_sale_price, sum_discount, max_discount, datapoints
+)
+select
+    r.vendor, d.item_id, d.fetched_at::date,
+    min(d.price), max(d.price), sum(d.price),
+    min(d.sale_price), max(d.sale_price), sum(d.sale_price),
+    sum(d.discount), max(d.discount),
+    count(*)
+from datapoints d
+join runs r on r.id = d.run_id
+where d.run_id = %(run_id)s
+group by r.vendor, d.item_id, d.fetched_at::date
+on conflict (vendor, item_id, day) do update set
+    min_price = least(daily_prices.min_price, excluded.min_price),
+    max_price = greatest(daily_prices.max_price, excluded.max_price),
+    sum_price = daily_prices.sum_price + excluded.sum_price,
+    min_sale_price = least(daily_prices.min_sale_price, excluded.min_sale_price),
+    max_sale_price = greatest(daily_prices.max_sale_price, excluded.max_sale_price),
+    sum_sale_price = daily_prices.sum_sale_price + excluded.sum_sale_price,
+    sum_discount = daily_prices.sum_discount + excluded.sum_discount,
+    max_discount = greatest(daily_prices.max_discount, excluded.max_discount),
+    datapoints = daily_prices.datapoints + excluded.datapoints
+"""
+
+
+# latest_prices for --store changes, from the versions a run opened.
+UPDATE_LATEST_PRICES_FROM_CHANGES = """
+insert into latest_prices (
+    vendor, unique_key, item_id, name, quantity, unit, base_quantity,
+    base_unit, stock, price, sale_price, discount, fetched_at, run_id
+)
+select
+    vendor, unique_key, item_id, name, quantity, unit, base_quantity,
+    base_unit, stock, price, sale_price, discount, fetched_at, valid_from_run
+from price_changes
+where valid_from_run = %(run_id)s
+on conflict (vendor, unique_key) do update set
+    item_id = excluded.item_id,
+    name = excluded.name,
+    quantity = excluded.quantity,
+    unit = excluded.unit,
+    base_quantity = excluded.base_quantity,
+    base_unit = excluded.base_unit,
+    stock = excluded.stock,
+    price = excluded.price,
+    sale_price = excluded.sale_price,
+    discount = excluded.discount,
+    fetched_at = excluded.fetched_at,
+    run_id = excluded.run_id
+"""
+
+
+# daily_prices for --store changes, from every listing a run saw, changed or
+# not, which store_changes copies into seen_prices.
+UPDATE_DAILY_PRICES_FROM_CHANGES = """
+insert into daily_prices (
+    vendor, item_id, day, min_price, max_price, sum_price, min_sale_price,
+    max_sale_price, sum_sale_price, sum_discount, max_discount, datapoints
+)
+select
+    %(vendor)s, item_id, fetched_at::date,
+    min(price), max(price), sum(price),
+    min(sale_price), max(sale_price), sum(sale_price),
+    sum(discount), max(discount),
+    count(*)
+from (
+    select
+        *,
+        case
+            when sale_price is null
+                then null
+            else (price - sale_price) / price * 100
+        end as discount
+    from seen_prices
+) s
+group by item_id, fetched_at::date
+on conflict (vendor, item_id, day) do update set
+    min_price = least(daily_prices.min_price, excluded.min_price),
+    max_price = greatest(daily_prices.max_price, excluded.max_price),
+    sum_price = daily_prices.sum_price + excluded.sum_price,
+    min_sale_price = least(daily_prices.min_sale_price, excluded.min_sale_price),
+    max_sale_price = greatest(daily_prices.max_sale_price, excluded.max_sale_price),
+    sum_sale_price = daily_prices.sum_sale_price + excluded.sum_sale_price,
+    sum_discount = daily_prices.sum_discount + excluded.sum_discount,
+    max_discount = greatest(daily_prices.max_discount, excluded.max_discount),
+    datapoints = daily_prices.datapoints + excluded.datapoints
+"""
+
+
+INSERT_UNCHANGED = f"""
+insert into datapoints ({DATAPOINT_COLUMNS})
+select
+    l.item_id, l.name, l.quantity, l.unit, l.stock, l.price, l.sale_price,
+    l.base_quantity, l.base_unit, l.unique_key, m.fetched_at, %(run_id)s
+from unnest(%(keys)s::varchar[], %(dates)s::timestamp[]) as m (unique_key, fetched_at)
+join latest_prices l on l.vendor = %(vendor)s and l.unique_key = m.unique_key
+"""
+
+
+def insert_unchanged(
+    cur: psycopg.Cursor, vendor: str, run_id: int, unchanged: dict[str, datetime]
+) -> int:
+    """
+    Write a datapoint for every listing an incremental crawl only marked as
+    unchanged, copied from its row in latest_prices, so the run's datapoints
+    and daily_prices still cover it. Must run before the run's own rows are
+    merged into latest_prices. Returns the number of rows written.
+    """
+    if not unchanged:
+        return 0
+    cur.execute(
+        INSERT_UNCHANGED,
+        {
+            "vendor": vendor,
+            "run_id": run_id,
+            "keys": list(unchanged),
+            "dates": list(unchanged.values()),
+        },
+    )
+    if cur.rowcount < len(unchanged):
+        # Only if latest_prices lost track of them, e.g. the incremental
+        # store outlived the database.
+        metrics.inc("etl_unchanged_missing_total", len(unchanged) - cur.rowcount, vendor=vendor)
+        logging.warning(
+            "%s listings marked unchanged have no stored row to copy",
+            len(unchanged) - cur.rowcount,
+        )
+    return cur.rowcount
+
+
+def update_serving_tables(cur: psycopg.Cursor, run_id: int):
+    """
+    Merge the datapoints of one run into latest_prices and daily_prices. Only
+    the run's own rows are read, through the run_id of the unique constraint.
+    """
+    cur.execute(UPDATE_LATEST_PRICES, {"run_id": run_id})
+    cur.execute(UPDATE_DAILY_PRICES, {"run_id": run_id})
+
+
+PRICE_CHANGE_COLUMNS = "item_id, name, quantity, unit, stock, price, sale_price, base_quantity, base_unit, unique_key, fetched_at, vendor, valid_from, valid_from_run"
+
+PRICE_CHANGE_TYPES = [*DATAPOINT_TYPES[:-1], "varchar", "timestamp", "int4"]
+
+
+def load_state(cur: psycopg.Cursor, vendor: str) -> dict[str, Listing]:
+    """
+    Current version of every listing of a vendor. Numbers come back as floats,
+    so they compare equal to the values the loaders produce.
+    """
+    cur.execute(
+        """select unique_key, item_id, name, quantity::float8, unit, stock,
+                price::float8, sale_price::float8, base_quantity::float8, base_unit
+            from price_changes
+            where vendor = %s and valid_to is null""",
+        (vendor,),
+    )
+    return {row[0]: row[1:] for row in cur}
+
+
+def store_changes(
+    cur: psycopg.Cursor,
+    run: Run,
+    run_id: int,
+    rows: Iterable[RowValues],
+    metadata: dict,
+) -> int | None:
+    """
+    Compare `rows` with the last known state of every listing, closing the
+    versions that changed or disappeared and writing new ones. Listings
+    reported unchanged by an incremental crawl count as seen. Every listing
+    seen is merged into daily_prices, like a datapoint would be. Returns the
+    number of new versions, or None if the run is older than the stored state.
+    """
+    result = cur.execute(
+        "select max(greatest(valid_from, valid_to)) from price_changes where vendor = %s",
+        (run.vendor,),
+    ).fetchone()
+    if result is not None and result[0] is not None and result[0] >= run.started_at:
+        logging.error(
+            "run %s is older than the stored changes of %s, load runs in order",
+            run.run_id,
+            run.vendor,
+        )
+        return None
+
+    state = load_state(cur, run.vendor)
+    # Versions are buffered, which is fine as long as most listings don't
+    # change between runs. The prices of every row are streamed into
+    # seen_prices for daily_prices on the way.
+    versions = []
+    closed = []
+    cur.execute(
+        """create temporary table seen_prices (
+            item_id varchar, fetched_at timestamp, price decimal, sale_price decimal
+        ) on commit drop"""
+    )
+    with cur.copy("copy seen_prices from stdin (format binary)") as copy:
+        copy.set_types(["varchar", "timestamp", "numeric", "numeric"])
+        for row in rows:
+            copy.write_row(
+                (row[0], row[10], Decimal(str(row[5])), Decimal(str(row[6])))
+            )
+            key = row[9]
+            old = state.pop(key, None)
+            if old == row[:9]:
+                continue
+            if old is not None:
+                closed.append(key)
+            versions.append(row)
+
+        # Unchanged listings were seen at their stored version.
+        unchanged = metadata.get("unchanged", {})
+        for key, fetched_at in unchanged.items():
+            old = state.get(key)
+            if old is not None:
+                copy.write_row(
+                    (old[0], fetched_at, Decimal(str(old[5])), Decimal(str(old[6])))
+                )
+
+    # Whatever is left was not in this run.
+    closed.extend(key for key in state if key not in unchanged)
+
+    cur.execute("create temporary table closed_keys (unique_key varchar) on commit drop")
+    with cur.copy("copy closed_keys from stdin") as copy:
+        for key in closed:
+            copy.write_row((key,))
+    cur.execute(
+        """update price_changes p set valid_to = %s, valid_to_run = %s
+            from closed_keys c
+            where p.vendor = %s and p.unique_key = c.unique_key and p.valid_to is null""",
+        (run.started_at, run_id, run.vendor),
+    )
+
+    with cur.copy(
+        f"copy price_changes({PRICE_CHANGE_COLUMNS}) from stdin (format binary)"
+    ) as copy:
+        copy.set_types(PRICE_CHANGE_TYPES)
+        for row in versions:
+            copy.write_row(
+                (
+                    *row[:2],
+                    Decimal(str(row[2])),
+                    *row[3:5],
+                    Decimal(str(row[5])),
+                    Decimal(str(row[6])),
+                    None if row[7] is None else Decimal(str(row[7])),
+                    *row[8:],
+                    run.vendor,
+                    run.started_at,
+                    run_id,
+                )
+            )
+
+    cur.execute(UPDATE_LATEST_PRICES_FROM_CHANGES, {"run_id": run_id})
+    cur.execute(UPDATE_DAILY_PRICES_FROM_CHANGES, {"vendor": run.vendor})
+    logging.info(
+        "run %s: %s new versions, %s closed", run.run_id, len(versions), len(closed)
+    )
+    return len(versions)
+
+
+def add_months(d: date, months: int) -> date:
+    """
+    First day of the month `months` after the month of `d`.
+
+    >>> add_months(date(2025, 11, 15), 2)
+    datetime.date(2026, 1, 1)
+    >>> add_months(date(2025, 3, 1), -3)
+    datetime.date(2024, 12, 1)
+    """
+    year, month = divmod(d.year * 12 + d.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"datapoints_{month:%Y_%m}"
+
+
+def is_partitioned(cur: psycopg.Cursor) -> bool:
+    # Databases created before datapoints was partitioned have a plain table.
+    result = cur.execute(
+        "select exists (select from pg_partitioned_table where partrelid = to_regclass('datapoints'))"
+    ).fetchone()
+    return result is not None and result[0]
+
+
+def create_partitions(conn: psycopg.Connection, started_at: datetime, ended_at: datetime):
+    """
+    Create the monthly datapoints partitions a run needs. This runs in its own
+    short transaction, since creating a partition locks the whole table.
+    """
+    with conn.cursor() as cur:
+        if not is_partitioned(cur):
+            conn.rollback()
+            return
+
+        month = add_months(started_at.date(), 0)
+        while month <= ended_at.date():
+            name = partition_name(month)
+            exists = cur.execute("select to_regclass(%s)", (name,)).fetchone()
+            if exists is None or exists[0] is None:
+                # Workers of --jobs can race for the same month.
+                cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (name,))
+                cur.execute(
+                    sql.SQL(
+                        "create table if not exists {} partition of datapoints for values from ({}) to ({})"
+                    ).format(
+                        sql.Identifier(name),
+                        sql.Literal(str(month)),
+                        sql.Literal(str(add_months(month, 1))),
+                    )
+                )
+                logging.info("created partition %s", name)
+            month = add_months(month, 1)
+    conn.commit()
+
+
+def retire_partitions(conn: psycopg.Connection, retain_months: int, archive_dir: str | None):
+    """
+    Detach the monthly partitions older than `retain_months` months. With an
+    `archive_dir` they are exported there as gzipped CSV and dropped,
+    otherwise they are left behind as standalone tables. Those, and any a
+    failed export left behind, are archived by the next run with an
+    `archive_dir`.
+    """
+    cutoff = add_months(date.today(), -retain_months)
+    if archive_dir is not None:
+        os.makedirs(archive_dir, exist_ok=True)
+    with conn.cursor() as cur:
+        if not is_partitioned(cur):
+            logging.error("datapoints is not partitioned, nothing to retire")
+            conn.rollback()
+            return
+
+        partitions = cur.execute(
+            r"""select c.relname, i.inhrelid is not null from pg_class c
+                left join pg_inherits i
+                    on i.inhrelid = c.oid and i.inhparent = 'datapoints'::regclass
+                where c.relkind in ('r', 'p')
+                    and c.relnamespace = (
+                        select relnamespace from pg_class where oid = 'datapoints'::regclass
+                    )
+                    and c.relname ~ '^datapoints_\d{4}_\d{2}$'
+                order by c.relname"""
+        ).fetchall()
+        conn.commit()
+        for name, attached in partitions:
+            month = datetime.strptime(name, "datapoints_%Y_%m").date()
+            if add_months(month, 1) > cutoff:
+                continue
+
+            table = sql.Identifier(name)
+            if archive_dir is None:
+                if attached:
+                    cur.execute(sql.SQL("alter table datapoints detach partition {}").format(table))
+                    conn.commit()
+                    logging.info("detached partition %s", name)
+                continue
+
+            # Exported while still attached, and only detached and dropped
+            # once the archive is complete, so a failed export leaves the
+            # partition as it was.
+            filename = path.join(archive_dir, f"{name}.csv.gz")
+            with (
+                gzip.open(filename + ".tmp", "wb") as f,
+                cur.copy(sql.SQL("copy {} to stdout (format csv, header)").format(table)) as copy,
+            ):
+                for data in copy:
+                    f.write(data)
+            os.replace(filename + ".tmp", filename)
+            if attached:
+                cur.execute(sql.SQL("alter table datapoints detach partition {}").format(table))
+            cur.execute(sql.SQL("drop table {}").format(table))
+            conn.commit()
+            logging.info("archived partition %s to %s", name, filename)
+
+
+def insert_everything(
+    conn: psycopg.Connection,
+    run: Run,
+    rows: Iterable[RowValues],
+    batch_size: int,
+    engine: str = "insert",
+    store: str = "datapoints",
+    metadata: dict | None = None,
+) -> int | None:
+    """
+    Insert the run and all of its rows in one transaction, writing `rows` to
+    `datapoints` with the given engine and merging them into the serving
+    tables. Returns the number of inserted rows, or None if the run was
+    already processed.
+
+    With `store="changes"` only changed listings are written, see
+    `store_changes`. `metadata` is the one the loader of `rows` fills.
+    """
+    # Filled while `rows` are read, so it has to be the loader's own dict even
+    # while it is still empty.
+    if metadata is None:
+        metadata = {}
+    if store == "datapoints":
+        create_partitions(conn, run.started_at, run.ended_at or run.started_at)
     with conn.cursor() as cur:
         try:
             result = cur.execute(
-                """insert into runs(run_id, started_at, ended_at, vendor) values(%s, %s, %s, %s) returning id""",
+                """insert into runs(run_id, started_at, ended_at, vendor, completed_at) values(%s, %s, %s, %s, now()) returning id""",
                 (run.run_id, run.started_at, run.ended_at, run.vendor),
             )
         except UniqueViolation:
             logging.error("run id %s is probably already processed", run.run_id)
             conn.rollback()
-            return
+            return None
 
         fetched = result.fetchone()
 
         assert fetched is not None
         run_id = fetched[0]
 
-        values = (
-            [
-                r.id,
-                r.name,
-                r.quantity,
-                r.unit,
-                r.stock,
-                r.price,
-                r.sale_price,
-                r.unique_key,
-                r.date,
-                run_id,
-            ]
-            for r in rows
+        if store == "changes":
+            count = store_changes(cur, run, run_id, rows, metadata)
+            if count is None:
+                conn.rollback()
+                return None
+        else:
+            count = ENGINES[engine](cur, run_id, rows, batch_size)
+            count += insert_unchanged(cur, run.vendor, run_id, metadata.pop("unchanged", {}))
+            update_serving_tables(cur, run_id)
+        conn.commit()
+        return count
+
+
+def start_run(conn: psycopg.Connection, run: Run) -> int | None:
+    """
+    Commit an incomplete run, to add its datapoints to in later transactions.
+    Returns its id, or None if the run was already processed.
+    """
+    try:
+        result = conn.execute(
+            """insert into runs(run_id, started_at, ended_at, vendor) values(%s, %s, %s, %s) returning id""",
+            (run.run_id, run.started_at, run.ended_at, run.vendor),
         )
-        cur.executemany(
-            """insert into datapoints(item_id, name, quantity, unit, stock, price, sale_price, unique_key, fetched_at, run_id)
-                values(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-            values,
+    except UniqueViolation:
+        logging.error("run id %s is probably already processed", run.run_id)
+        conn.rollback()
+        return None
+
+    fetched = result.fetchone()
+    assert fetched is not None
+    conn.commit()
+    return fetched[0]
+
+
+def insert_checkpointed(
+    conn: psycopg.Connection,
+    run: Run,
+    run_id: int | None,
+    lines: LineCounter,
+    rows: Iterable[RowValues],
+    batch_size: int,
+    engine: str,
+    checkpoint_every: int,
+    metadata: dict,
+) -> int | None:
+    """
+    Like `insert_everything`, but commits every `checkpoint_every` rows along
+    with the number of lines read so far. `run_id` is the id of an
+    interrupted load of this run to resume, `lines` must then start at its
+    lines_loaded. The serving tables are updated once the run is complete.
+
+    Unchanged markers read so far are expanded with every commit, since a
+    resumed load doesn't read them again.
+    """
+    if run_id is None:
+        create_partitions(conn, run.started_at, run.ended_at or run.started_at)
+        run_id = start_run(conn, run)
+        if run_id is None:
+            return None
+
+    with conn.cursor() as cur:
+        count = 0
+        for batch in batched(rows, checkpoint_every):
+            count += ENGINES[engine](cur, run_id, batch, batch_size)
+            count += insert_unchanged(cur, run.vendor, run_id, metadata.pop("unchanged", {}))
+            cur.execute(
+                "update runs set lines_loaded = %s where id = %s", (lines.count, run_id)
+            )
+            conn.commit()
+
+        count += insert_unchanged(cur, run.vendor, run_id, metadata.pop("unchanged", {}))
+        update_serving_tables(cur, run_id)
+        cur.execute(
+            "update runs set lines_loaded = %s, completed_at = now() where id = %s",
+            (lines.count, run_id),
         )
         conn.commit()
+        return count
 
 
 def filesize_nice(size: int | float):
@@ -219,26 +1022,195 @@ def filesize_nice(size: int | float):
     return f"{size:.1f}GiB"
 
 
-if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.INFO)
-    namespace = parser.parse_args()
-
-    conn = psycopg.connect(namespace.dsn)
-
-    for filename in namespace.files:
-        read_started = datetime.now()
-        with open(filename) as f:
-            metadata, rows = load(f)
-        read_ended = datetime.now()
-        logging.info(
-            "read file %s (%s) in %s",
-            filename,
-            filesize_nice(path.getsize(filename)),
-            read_ended - read_started,
+class LoadOptions(BaseModel):
+    batch_size: int
+    engine: str
+    decoder: str
+    store: str
+    checkpoint_every: int
+    profile: list[str] = []
+
+    @classmethod
+    def from_namespace(cls, namespace) -> "LoadOptions":
+        return cls(
+            batch_size=namespace.batch_size,
+            engine=namespace.engine,
+            decoder=namespace.decoder,
+            store=namespace.store,
+            checkpoint_every=namespace.checkpoint_every,
+            profile=namespace.profile,
         )
 
-        run = Run.from_filename(filename, metadata)
-        insert_everything(conn, run, rows)
-        logging.info(
-            "inserted %s data rows in %s", len(rows), datetime.now() - read_ended
+
+def load_file(conn: psycopg.Connection, filename: str, options: LoadOptions) -> None:
+    if not options.profile:
+        return load_file_unprofiled(conn, filename, options)
+
+    # The functions of this module look each other up as module globals, so
+    # swapping those for profiled wrappers is enough.
+    module = sys.modules[__name__]
+    session = ProfileSession([(name, module, name) for name in options.profile])
+    session.start()
+    try:
+        load_file_unprofiled(conn, filename, options)
+    finally:
+        session.stop()
+        prefix = run_prefix(filename)
+        written = session.dump(prefix)
+        for name in written:
+            logging.info("wrote profile %s", name)
+        for stage in options.profile:
+            if f"{prefix}.{stage}.pstats" not in written:
+                logging.warning("%s didn't run for %s, so it has no profile", stage, filename)
+
+
+def load_file_unprofiled(conn: psycopg.Connection, filename: str, options: LoadOptions) -> None:
+    started = datetime.now()
+    metadata: dict = {}
+    run = Run.from_filename(filename, metadata)
+
+    # Look the run up before reading anything, so loading a directory of
+    # mostly loaded files again is cheap.
+    existing = conn.execute(
+        "select id, lines_loaded, completed_at from runs where run_id = %s",
+        (run.run_id,),
+    ).fetchone()
+    conn.commit()
+    resume_id, resume_line = None, 0
+    if existing is not None:
+        if existing[2] is not None:
+            metrics.inc("etl_files_skipped_total", vendor=run.vendor)
+            logging.info("skipping file %s, run %s is already loaded", filename, run.run_id)
+            return
+        resume_id, resume_line = existing[0], existing[1]
+
+    checkpointed = (
+        options.checkpoint_every > 0
+        and options.store == "datapoints"
+        and not filename.endswith(".parquet")
+    )
+    if resume_id is not None and not checkpointed:
+        logging.error(
+            "run %s was partially loaded with checkpoints, load it again the same way",
+            run.run_id,
         )
+        return
+    if resume_id is not None:
+        logging.info("resuming file %s from line %s", filename, resume_line)
+
+    # Rows are parsed while they are being inserted, so reading and
+    # inserting are timed together.
+    if checkpointed:
+        with open_input(filename) as f:
+            lines = LineCounter(f, resume_line)
+            if options.decoder == "fast":
+                rows = load_fast(lines, metadata)
+            else:
+                rows = (row.values() for row in load(lines, metadata))
+            count = insert_checkpointed(
+                conn,
+                run,
+                resume_id,
+                lines,
+                rows,
+                options.batch_size,
+                options.engine,
+                options.checkpoint_every,
+                metadata,
+            )
+    elif filename.endswith(".parquet"):
+        rows = load_parquet(filename, metadata)
+        count = insert_everything(
+            conn,
+            run,
+            rows,
+            options.batch_size,
+            options.engine,
+            options.store,
+            metadata,
+        )
+    else:
+        with open_input(filename) as f:
+            if options.decoder == "fast":
+                rows = load_fast(f, metadata)
+            else:
+                rows = (row.values() for row in load(f, metadata))
+            count = insert_everything(
+                conn,
+                run,
+                rows,
+                options.batch_size,
+                options.engine,
+                options.store,
+                metadata,
+            )
+    if count is None:
+        return
+    elapsed = datetime.now() - started
+    metrics.inc("etl_rows_total", count, vendor=run.vendor, store=options.store)
+    metrics.observe("etl_file_seconds", elapsed.total_seconds(), vendor=run.vendor)
+    logging.info(
+        "loaded %s data rows from file %s (%s) in %s (%.0f rows/s)",
+        count,
+        filename,
+        filesize_nice(path.getsize(filename)),
+        elapsed,
+        count / max(elapsed.total_seconds(), 1e-6),
+    )
+
+
+# Every worker process of --jobs keeps its own connection for all the files it
+# is handed.
+_worker_conn: psycopg.Connection | None = None
+
+
+def init_worker(dsn: str):
+    global _worker_conn
+    logging.getLogger().setLevel(logging.INFO)
+    _worker_conn = psycopg.connect(dsn)
+
+
+def load_file_in_worker(filename: str, options: LoadOptions) -> dict:
+    """Load a file, returning the metrics it recorded for the parent."""
+    assert _worker_conn is not None
+    metrics.REGISTRY.clear()
+    load_file(_worker_conn, filename, options)
+    return metrics.REGISTRY.summary()
+
+
+def main(argv: list[str] | None = None):
+    """Run etl.py with the command line `argv`, main.py passes its --etl here."""
+    logging.getLogger().setLevel(logging.INFO)
+    namespace = parser.parse_args(argv)
+    if not namespace.files and namespace.retain_months is None:
+        parser.error("no files to load")
+    options = LoadOptions.from_namespace(namespace)
+    # The summary only covers this load, not e.g. crawls that ran before it
+    # in the same process.
+    metrics.REGISTRY.clear()
+
+    if namespace.jobs > 1:
+        with ProcessPoolExecutor(
+            namespace.jobs, initializer=init_worker, initargs=(namespace.dsn,)
+        ) as executor:
+            futures = [
+                executor.submit(load_file_in_worker, filename, options)
+                for filename in namespace.files
+            ]
+            for future in futures:
+                metrics.REGISTRY.merge(future.result())
+    else:
+        conn = psycopg.connect(namespace.dsn)
+        for filename in namespace.files:
+            load_file(conn, filename, options)
+
+    if namespace.retain_months is not None:
+        with psycopg.connect(namespace.dsn) as conn:
+            retire_partitions(conn, namespace.retain_months, namespace.archive_dir)
+
+    if namespace.metrics:
+        metrics.write_summary(namespace.metrics, files=namespace.files)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,189 @@
+import logging
+import os
+import uuid
+from argparse import REMAINDER, ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime
+
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from bananalytics import metrics
+from bananalytics.profiling import ProfileSession, resolve, run_prefix, spider_targets
+
+logger = logging.getLogger(__name__)
+
+parser = ArgumentParser(
+    description="Crawl the vendors concurrently in one process, and optionally load the runs."
+)
+parser.add_argument("spiders", nargs="*", help="spiders to run, all of them by default")
+parser.add_argument(
+    "--output-dir",
+    default="raw_files",
+    help="where run files are written, as <vendor>_<start>_<end>_<run_id>.jsonlines.gz",
+)
+parser.add_argument(
+    "--etl",
+    nargs=REMAINDER,
+    metavar="ETL_ARGS",
+    help="load the runs into the database once all crawls are over, passing everything after --etl on to etl.py, e.g. --etl --dsn postgresql:///bananalytics --engine copy",
+)
+
+
+@dataclass
+class CrawlRun:
+    vendor: str
+    run_id: str
+    output_dir: str
+    started_at: datetime | None = None
+    ended_at: datetime | None = None
+
+    @property
+    def output(self) -> str:
+        # Where the feed writes while the crawl runs. The start and end of
+        # the run aren't both known until it is over.
+        return os.path.join(self.output_dir, f"{self.vendor}_{self.run_id}.jsonlines.gz")
+
+    def filename(self) -> str:
+        """The name etl.Run.from_filename expects."""
+        assert self.started_at is not None and self.ended_at is not None
+        return os.path.join(
+            self.output_dir,
+            f"{self.vendor}_{self.started_at:%Y%m%d%H%M%S}_{self.ended_at:%Y%m%d%H%M%S}_{self.run_id}.jsonlines.gz",
+        )
+
+
+def crawl(spiders: list[str], output_dir: str) -> list[str]:
+    """
+    Run `spiders` side by side on one reactor and return the run files they
+    wrote. Each crawler has its own downloader, so the per domain budgets of
+    DOWNLOAD_SLOTS hold within every crawl. The feeds are gzipped as they are
+    written, rather than once the crawl is over. With DATABASE_SINK_ENABLED
+    the sink stores the runs instead and no run files are written.
+
+    The metrics registry and the profiled functions are per process, so the
+    metrics are served and the PROFILE_TARGETS profiled here for all of the
+    crawls, from before the first one starts until the last one is over.
+    """
+    settings = get_project_settings()
+    process = CrawlerProcess(settings)
+    os.makedirs(output_dir, exist_ok=True)
+    # The database sink archives and loads every run itself, a feed of the
+    # same items would only store them a second time under another run.
+    sink = settings.getbool("DATABASE_SINK_ENABLED")
+
+    port = settings.getint("METRICS_PORT") if settings.getbool("METRICS_ENABLED") else 0
+    targets = [t for target in settings.getlist("PROFILE_TARGETS") for t in resolve(target)]
+    # Before the engines exist, so the pipelines pick up the wrappers.
+    session = ProfileSession(targets)
+    session.start()
+
+    runs = []
+    for i, name in enumerate(spiders or process.spider_loader.list()):
+        run = CrawlRun(name, uuid.uuid4().hex[:7], output_dir)
+        crawler_settings = settings.copy()
+        if not sink:
+            crawler_settings.set(
+                "FEEDS",
+                {
+                    run.output: {
+                        "format": "jsonlines",
+                        "overwrite": True,
+                        "postprocessing": ["scrapy.extensions.postprocessing.GzipPlugin"],
+                    }
+                },
+                priority="cmdline",
+            )
+        crawler_settings.set("METRICS_PORT", 0, priority="cmdline")
+        crawler_settings.set("PROFILE_TARGETS", [], priority="cmdline")
+
+        # Like CrawlerProcess.crawl(name) would, but with settings of its own.
+        crawler = Crawler(process.spider_loader.load(name), crawler_settings, init_reactor=i == 0)
+        run.started_at = datetime.now()
+        process.crawl(crawler).addBoth(ended, run)
+        runs.append(run)
+
+    server = metrics.serve(port) if port else None
+    if server is not None:
+        logger.info("serving metrics on http://127.0.0.1:%s/metrics", port)
+    started_at = datetime.now()
+    try:
+        process.start()
+    finally:
+        if server is not None:
+            server.shutdown()
+        session.stop()
+    if targets:
+        dump_profiles(
+            session, runs, process.spider_loader, settings.get("PROFILE_DIR"), started_at, sink
+        )
+
+    filenames: list[str] = []
+    if sink:
+        return filenames
+    for run in runs:
+        if not os.path.exists(run.output):
+            logger.warning("%s wrote nothing", run.vendor)
+            continue
+        os.replace(run.output, run.filename())
+        filenames.append(run.filename())
+        logger.info("wrote %s", run.filename())
+    return filenames
+
+
+def dump_profiles(
+    session: ProfileSession,
+    runs: list[CrawlRun],
+    spider_loader,
+    directory: str,
+    started_at: datetime,
+    sink: bool,
+):
+    """
+    Write the profiles of each spider's own functions next to its run file,
+    named after it, or to `directory` when the database sink stores the runs.
+    The functions every crawl runs, like pipelines, are written under the
+    run when there is only one, and to `directory` otherwise.
+    """
+    os.makedirs(directory, exist_ok=True)
+    shared = {name for name, _, _ in session.targets}
+    for run in runs:
+        prefix = run_prefix(run.filename())
+        if sink:
+            prefix = os.path.join(directory, os.path.basename(prefix))
+        names = spider_targets(session.targets, spider_loader.load(run.vendor))
+        if len(runs) == 1:
+            names = list(shared)
+        shared -= set(names)
+        for filename in session.dump(prefix, names):
+            logger.info("wrote profile %s", filename)
+    if shared:
+        ended_at = datetime.now()
+        prefix = os.path.join(directory, f"crawl_{started_at:%Y%m%d%H%M%S}_{ended_at:%Y%m%d%H%M%S}")
+        for filename in session.dump(prefix, sorted(shared)):
+            logger.info("wrote profile %s", filename)
+
+
+def ended(result, run: CrawlRun):
+    run.ended_at = datetime.now()
+    return result
+
+
 def main():
-    print("Hello from bananalytics!")
+    namespace = parser.parse_args()
+    filenames = crawl(namespace.spiders, namespace.output_dir)
+    if namespace.etl is None:
+        return
+    if get_project_settings().getbool("DATABASE_SINK_ENABLED"):
+        logger.info("the database sink loaded the runs already, ignoring --etl")
+        return
+    if not filenames:
+        return
+
+    # Only needed when loading, so crawling works without a database driver.
+    import etl
+
+    etl.main([*namespace.etl, *filenames])
 
 
 if __name__ == "__main__":
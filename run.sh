@@ -3,23 +3,6 @@
 uv sync
 source ./.venv/bin/activate
 
-files=()
-
-for vendor in chaldal meenabazar; do
-	run_id=$(head -c 8 /dev/random | sha1sum | head -c 7)
-	downloaded_file=raw_files/$run_id.jsonlines
-
-	mkdir -p raw_files/
-
-	start=$(date '+%Y%m%d%H%M%S')
-	time ./.venv/bin/scrapy crawl $vendor -o $downloaded_file
-	end=$(date '+%Y%m%d%H%M%S')
-
-	final_file=raw_files/${vendor}_${start}_${end}_${run_id}.jsonlines
-	mv $downloaded_file $final_file
-	files+=($final_file)
-done
-
-echo
-echo
-gzip -v "${files[@]}"
+# Crawls every vendor concurrently, writing gzipped run files to raw_files/.
+# Pass e.g. --etl --dsn <dsn> to load them into the database afterwards.
+time python main.py "$@"
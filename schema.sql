@@ -9,14 +9,31 @@ create table if not exists runs (
     ended_at timestamp
 );
 
+-- Progress of etl.py through the file of a run. A run is only loaded once
+-- completed_at is set, runs loaded before this column existed are complete.
+alter table runs add column if not exists lines_loaded int not null default 0;
+alter table runs add column if not exists completed_at timestamp default now();
+alter table runs alter column completed_at drop default;
+
+-- Partitioned by month of fetched_at. etl.py creates the partition of every
+-- month it loads, and detaches old ones with --retain-months. Rows outside of
+-- every partition land in datapoints_default.
+--
+-- A database created before partitioning keeps its plain datapoints table,
+-- etl.py then skips partition management. Migrating means creating the new
+-- table under another name, copying the rows over and swapping the names.
 create table if not exists datapoints (
-    id serial primary key,
+    id serial,
 
     name varchar not null,
     item_id varchar not null,
 
     quantity decimal not null,
     unit varchar not null,
+    -- Quantity in kg, l or pcs, for comparing prices per unit. Null when the
+    -- unit is not recognized.
+    base_quantity decimal,
+    base_unit varchar,
     stock int not null,
 
     price decimal not null,
@@ -41,6 +58,146 @@ create table if not exists datapoints (
 
     run_id int references runs (id) not null,
 
-    unique (run_id, unique_key)
+    -- Constraints on a partitioned table have to include the partition key.
+    primary key (id, fetched_at),
+    unique (run_id, unique_key, fetched_at)
+) partition by range (fetched_at);
+
+-- Only a partitioned datapoints can take a default partition.
+do $$
+begin
+    if exists (
+        select from pg_partitioned_table
+        where partrelid = to_regclass('datapoints')
+    ) then
+        create table if not exists datapoints_default partition of datapoints default;
+    end if;
+end
+$$;
+
+alter table datapoints add column if not exists base_quantity decimal;
+alter table datapoints add column if not exists base_unit varchar;
+
+-- Price history of an item.
+create index if not exists datapoints_item_id_fetched_at on datapoints (item_id, fetched_at);
+
+-- Serving tables for dashboards, kept current by etl.py in the same
+-- transaction that loads a run, so they never need a full recomputation.
+
+-- Most recently fetched datapoint of every listing.
+create table if not exists latest_prices (
+    vendor varchar not null,
+    unique_key varchar not null,
+
+    item_id varchar not null,
+    name varchar not null,
+
+    quantity decimal not null,
+    unit varchar not null,
+    base_quantity decimal,
+    base_unit varchar,
+    stock int not null,
+
+    price decimal not null,
+    sale_price decimal,
+    discount decimal,
+
+    fetched_at timestamp not null,
+    run_id int references runs (id) not null,
+
+    primary key (vendor, unique_key)
 );
+create index if not exists latest_prices_item_id on latest_prices (item_id);
+
+-- Per item and day aggregates over all of a vendor's branches. Sums and
+-- counts rather than averages, so a run can be merged into an existing day.
+create table if not exists daily_prices (
+    vendor varchar not null,
+    item_id varchar not null,
+    day date not null,
+
+    min_price decimal not null,
+    max_price decimal not null,
+    sum_price decimal not null,
+
+    min_sale_price decimal,
+    max_sale_price decimal,
+    sum_sale_price decimal,
+
+    sum_discount decimal,
+    max_discount decimal,
+
+    datapoints int not null,
+
+    primary key (vendor, item_id, day)
+);
+
+create or replace view daily_price_stats as
+    select
+        vendor,
+        item_id,
+        day,
+        min_price,
+        max_price,
+        sum_price / datapoints as avg_price,
+        min_sale_price,
+        max_sale_price,
+        sum_sale_price / datapoints as avg_sale_price,
+        sum_discount / datapoints as avg_discount,
+        max_discount,
+        datapoints
+    from daily_prices;
+-- Written instead of datapoints by `etl.py --store changes`: one row per
+-- version of a listing, valid from the run that first saw it until the run
+-- that saw it change or disappear. Validity is in terms of the runs'
+-- started_at, so runs of a vendor have to be loaded in order.
+create table if not exists price_changes (
+    vendor varchar not null,
+    unique_key varchar not null,
+
+    item_id varchar not null,
+    name varchar not null,
+
+    quantity decimal not null,
+    unit varchar not null,
+    base_quantity decimal,
+    base_unit varchar,
+    stock int not null,
+
+    price decimal not null,
+    sale_price decimal,
+    discount decimal generated always as (
+        case
+            when sale_price is null
+                then null
+            else (price - sale_price) / price * 100
+        end
+    ) stored,
+
+    fetched_at timestamp not null,
+
+    valid_from timestamp not null,
+    valid_from_run int references runs (id) not null,
+    -- Null while this is the current version.
+    valid_to timestamp,
+    valid_to_run int references runs (id),
+
+    primary key (vendor, unique_key, valid_from)
+);
+-- The state etl.py compares every run against.
+create unique index if not exists price_changes_current on price_changes (vendor, unique_key)
+    where valid_to is null;
+
+-- Listings as they were in a run, rebuilt from price_changes.
+create or replace function price_snapshot(snapshot_run_id int)
+returns setof price_changes
+language sql stable
+as $$
+    select p.*
+    from price_changes p
+    join runs r on r.id = snapshot_run_id and r.vendor = p.vendor
+    where p.valid_from <= r.started_at
+        and (p.valid_to is null or p.valid_to > r.started_at)
+$$;
+
 -- create trigger if not exists pre_insert_hook before insert on data